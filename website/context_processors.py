@@ -1,6 +1,6 @@
 from django.conf import settings
 import random
-from website.models import Site, Page
+from website.models import Site, get_site_for_request, get_site_nurseries
 
 def site(request):
 
@@ -11,13 +11,8 @@ def site(request):
     except:
         work_offline = False
 
-    url = request.META.get("HTTP_HOST")
-    url = url.lower()
-    
-    if "site" in request.COOKIES:
-        site = Site.objects.get(id=request.COOKIES["site"])
-    else:
-        site = Site.objects.get(url=url)
+    # Shares the lookup with get_site() in the views, so this does not hit the database again
+    site = get_site_for_request(request)
 
     sites = None
     if settings.DEBUG:
@@ -68,6 +63,6 @@ def site(request):
         "GARDEN": garden,
         "GARDEN_NAME": garden_name,
         "GARDEN_ACTIVE": garden_active,
-        "NURSERIES": Page.objects.filter(site=site, page_type=Page.PageType.NURSERY),
+        "NURSERIES": get_site_nurseries(site),
         "JOIN_MENU": join_menu,
     }
@@ -0,0 +1,338 @@
+from django.contrib.gis import geos
+from django.contrib.gis.gdal import CoordTransform, DataSource, SpatialReference
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.test.utils import CaptureQueriesContext
+
+from website.models import Document, FeatureSiteScore, Genus, Language, ReferenceSpace, Site, Species, SpeciesFeatures, SpeciesSynonym, SpeciesText, update_space_shapes
+from website.scoring import SUGGESTION_MATRICES, rank_species
+from website.views import AUTOCOMPLETE_LIMIT, LANGUAGE_ID, get_clipped_length, normalize_species_names, search_species
+
+import math
+import os
+import pandas as pd
+import random
+import shapefile
+import tempfile
+import time
+
+# Compares the old and the new implementation of some of the heavier operations on synthetic data,
+# reporting the time (best of --repeat runs) and the number of queries of both. All synthetic data is
+# created inside a transaction that is rolled back at the end, so nothing is left behind.
+#   ./manage.py benchmark report_lengths --size 5000
+class Command(BaseCommand):
+    help = "Time old and new implementations against each other on synthetic data"
+
+    CASES = ["report_lengths", "shapefile_import", "shapefile_unions", "suggestions", "autocomplete", "species_preview"]
+
+    def add_arguments(self, parser):
+        parser.add_argument("case", choices=self.CASES)
+        parser.add_argument("--size", type=int, help="Size of the synthetic data set (the default depends on the case)")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        self.repeat = options["repeat"]
+        with transaction.atomic():
+            getattr(self, options["case"])(options["size"])
+            transaction.set_rollback(True)
+
+    def measure(self, label, function):
+        times = []
+        for _ in range(self.repeat):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                result = function()
+                times.append(time.perf_counter() - start)
+        self.stdout.write(f"{label}: {min(times)*1000:.1f} ms, {len(queries)} queries")
+        return result
+
+    # Numbers are compared with a small tolerance, as GEOS and PostGIS don't round in exactly the same way
+    def compare(self, old, new, label="Results"):
+        if isinstance(old, float):
+            same = math.isclose(old, new, rel_tol=1e-6)
+        else:
+            same = old == new
+        if not same:
+            raise CommandError(f"{label} differ: {old} (old) against {new} (new)")
+        self.stdout.write(self.style.SUCCESS(f"{label} are the same"))
+
+    # A dense river network around one point: every river is a random walk of 50 segments of about
+    # 100m, so that most of them cross the edge of the 1km circle of the report.
+    def report_lengths(self, size):
+        size = size or 2000
+        document = Document.objects.create(name="Benchmark rivers")
+        lng, lat = 18.47, -33.95
+        rivers = []
+        for _ in range(size):
+            x, y = lng + random.uniform(-0.02, 0.02), lat + random.uniform(-0.02, 0.02)
+            angle = random.uniform(0, 2*math.pi)
+            points = [(x, y)]
+            for _ in range(50):
+                angle += random.uniform(-0.5, 0.5)
+                x, y = x + math.cos(angle)*0.001, y + math.sin(angle)*0.001
+                points.append((x, y))
+            rivers.append(ReferenceSpace(name="River", source=document, geometry=geos.LineString(points, srid=4326)))
+        ReferenceSpace.objects.bulk_create(rivers, batch_size=1000)
+        self.stdout.write(f"{size} rivers")
+
+        # The same circle as in report()
+        center = geos.Point(x=lng, y=lat, srid=4326)
+        center.transform(3857)
+        circle = center.buffer(1000)
+        circle.transform(4326)
+        spaces = document.spaces.filter(Q(geometry__within=circle)|Q(geometry__intersects=circle))
+
+        def clip_in_python():
+            length = 0
+            for each in spaces:
+                geom = each.geometry.intersection(circle)
+                geom.transform(3857)
+                length += geom.length
+            return length
+
+        old = self.measure("GEOS per river (old)", clip_in_python)
+        new = self.measure("PostGIS aggregate (new)", lambda: get_clipped_length(spaces, circle))
+        self.compare(float(old), float(new), "Lengths")
+
+    # Writes a shapefile with a grid of squares of 50x50m in UTM zone 34S (so every feature needs to be
+    # transformed to WGS84), with a few attribute columns. Returns the path of the .shp file.
+    def write_shapefile(self, directory, size, groups=None):
+        path = os.path.join(directory, "benchmark.shp")
+        with shapefile.Writer(path, shapeType=shapefile.POLYGON) as writer:
+            writer.field("NAME", "C", 50)
+            writer.field("TYPE", "C", 20)
+            writer.field("HECTARES", "N", 12, 2)
+            columns = int(math.sqrt(size)) + 1
+            for count in range(size):
+                x = 260000 + (count % columns) * 60
+                y = 6240000 + (count // columns) * 60
+                writer.poly([[(x, y), (x, y+50), (x+50, y+50), (x+50, y), (x, y)]])
+                name = f"Group {count % groups}" if groups else f"Plot {count}"
+                writer.record(name, random.choice(["Park", "School", "Wetland"]), 0.25)
+        with open(os.path.join(directory, "benchmark.prj"), "w") as f:
+            f.write(SpatialReference(32734).wkt)
+        return path
+
+    # The import as it was: one INSERT per feature, a new CoordTransform for every feature and a WKT
+    # round trip, against the chunked bulk_create of Document.import_features()
+    def shapefile_import(self, size):
+        size = size or 10000
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write_shapefile(directory, size)
+            meta_data = {"columns": {"name": "NAME", "import": ["TYPE", "HECTARES"]}}
+            self.stdout.write(f"{size} features")
+
+            def import_per_feature():
+                document = Document.objects.create(name="Benchmark import", meta_data=meta_data)
+                layer = DataSource(path)[0]
+                for each in layer:
+                    features = {f: each.get(f) for f in layer.fields if f in meta_data["columns"]["import"]}
+                    geo = each.geom
+                    if layer.srs.srid != 4326:
+                        geo.transform(CoordTransform(layer.srs, SpatialReference("WGS84")))
+                    ReferenceSpace.objects.create(name=each.get("NAME"), geometry=geo.wkt, source=document, meta_data={"features": features})
+                return document
+
+            def import_in_chunks():
+                document = Document.objects.create(name="Benchmark import", meta_data=meta_data)
+                document.import_features(DataSource(path)[0])
+                update_space_shapes(ReferenceSpace.objects.filter(source=document))
+                return document
+
+            old = self.measure("One INSERT per feature (old)", import_per_feature)
+            new = self.measure("Chunked bulk_create (new)", import_in_chunks)
+
+        def summary(document):
+            spaces = ReferenceSpace.objects.filter(source=document)
+            return spaces.count(), spaces.aggregate(area=Sum("area"))["area"]
+
+        old_count, old_area = summary(old)
+        new_count, new_area = summary(new)
+        self.compare(old_count, new_count, "Numbers of spaces")
+        self.compare(old_area, new_area, "Total areas")
+
+    # Land use style layer: --size polygons spread over a handful of names. The old import grew every
+    # group one union at a time; Document.import_unions() does a single unary union per group.
+    def shapefile_unions(self, size):
+        size = size or 20000
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write_shapefile(directory, size, groups=5)
+            meta_data = {"columns": {"name": "NAME", "import": []}, "group_spaces_by_name": True}
+            self.stdout.write(f"{size} features in 5 groups")
+
+            def union_per_feature():
+                document = Document.objects.create(name="Benchmark unions", meta_data=meta_data)
+                layer = DataSource(path)[0]
+                ct = CoordTransform(layer.srs, SpatialReference("WGS84"))
+                spaces = {}
+                for each in layer:
+                    geo = each.geom
+                    geo.transform(ct)
+                    name = each.get("NAME")
+                    spaces[name] = spaces[name].union(geo) if name in spaces else geo
+                for name, geo in spaces.items():
+                    ReferenceSpace.objects.create(name=name, geometry=geo.wkt, source=document)
+                return document
+
+            def union_per_group():
+                document = Document.objects.create(name="Benchmark unions", meta_data=meta_data)
+                document.import_unions(DataSource(path)[0], group_by_name=True)
+                update_space_shapes(ReferenceSpace.objects.filter(source=document))
+                return document
+
+            old = self.measure("Union per feature (old)", union_per_feature)
+            new = self.measure("Unary union per group (new)", union_per_group)
+
+        def summary(document):
+            spaces = ReferenceSpace.objects.filter(source=document)
+            return sorted(spaces.values_list("name", flat=True)), spaces.aggregate(area=Sum("area"))["area"]
+
+        old_names, old_area = summary(old)
+        new_names, new_area = summary(new)
+        self.compare(old_names, new_names, "Groups")
+        self.compare(old_area, new_area, "Total areas")
+
+    # A site with --size species (default 10000), each with up to six of 40 features, and points for
+    # every feature. The old ranking was a correlated subquery per species plus a Max() and a count();
+    # the new one is a product with the in-memory species x feature matrix of the site.
+    def suggestions(self, size):
+        size = size or 10000
+        language = Language.objects.create(name="Benchmark", code="bm")
+        site = Site.objects.create(name="Benchmark site", url="benchmark.invalid", language=language)
+        genus = Genus.objects.create(name="Benchmark")
+        features = [SpeciesFeatures.objects.create(name=f"Benchmark feature {count}") for count in range(40)]
+        FeatureSiteScore.objects.bulk_create([FeatureSiteScore(site=site, feature=feature, points=random.randint(1, 5)) for feature in features])
+
+        species = Species.objects.bulk_create([Species(name=f"Benchmark species {count}", genus=genus) for count in range(size)], batch_size=1000)
+        Species.site.through.objects.bulk_create([Species.site.through(species_id=each.id, site_id=site.id) for each in species], batch_size=5000)
+        Species.features.through.objects.bulk_create([
+            Species.features.through(species_id=each.id, speciesfeatures_id=feature.id)
+            for each in species for feature in random.sample(features, random.randint(0, 6))
+        ], batch_size=5000)
+        self.stdout.write(f"{size} species")
+
+        feature_ids = [feature.id for feature in random.sample(features, 8)]
+        site_species = Species.objects.filter(site=site)
+
+        def rank_with_subquery():
+            score_subquery = FeatureSiteScore.objects.filter(
+                site=site, feature__in=feature_ids, feature__species=OuterRef("pk"),
+            ).values("feature__species").annotate(total=Sum("points")).values("total")
+            ranked = site_species.annotate(total_points=Coalesce(Subquery(score_subquery), Value(0))).order_by("-total_points")
+            max_points = ranked.aggregate(Max("total_points"))["total_points__max"]
+            ranked.count()
+            return [each.total_points for each in ranked[:50]], max_points
+
+        def rank_with_matrix(cold):
+            if cold:
+                SUGGESTION_MATRICES.pop(site.id, None)
+            candidate_ids = list(site_species.values_list("id", flat=True))
+            ids, points, max_points = rank_species(site, feature_ids, candidate_ids, 50)
+            return points, max_points
+
+        old = self.measure("Correlated subquery (old)", rank_with_subquery)
+        cold = self.measure("Feature matrix, rebuilt (new)", lambda: rank_with_matrix(cold=True))
+        warm = self.measure("Feature matrix, cached (new)", lambda: rank_with_matrix(cold=False))
+        self.compare(old, cold, "Top 50 scores")
+        self.compare(old, warm, "Top 50 scores")
+
+    # --size species (default 20000) with made up names and English common names, searched for with the
+    # short prefixes people type. The old autocomplete returned every match (with a JOIN on the texts, a
+    # DISTINCT and the sites of each species); search_species() ranks with the trigram indexes and only
+    # returns the best AUTOCOMPLETE_LIMIT.
+    def autocomplete(self, size):
+        size = size or 20000
+        language, created = Language.objects.get_or_create(id=LANGUAGE_ID, defaults={"name": "English", "code": "en"})
+        site = Site.objects.create(name="Benchmark site", url="benchmark.invalid", language=language)
+        genera = [Genus.objects.create(name=f"Benchmark{name}") for name in ["erica", "protea", "aloe", "restio", "oxalis"]]
+        syllables = ["ca", "lo", "ni", "pha", "ra", "sto", "me", "li", "ta", "gro"]
+
+        def make_word():
+            return "".join(random.choice(syllables) for _ in range(random.randint(2, 4)))
+
+        species = Species.objects.bulk_create([
+            Species(name=f"{random.choice(genera).name} {make_word()} {count}", genus=random.choice(genera)) for count in range(size)
+        ], batch_size=1000)
+        SpeciesText.objects.bulk_create([SpeciesText(species=each, language=language, common_name=f"{make_word()} bush") for each in species], batch_size=1000)
+        Species.site.through.objects.bulk_create([Species.site.through(species_id=each.id, site_id=site.id) for each in species[::3]], batch_size=5000)
+        self.stdout.write(f"{size} species")
+
+        def search_all(query):
+            species = Species.objects.prefetch_related("site").filter(
+                Q(name__icontains=query) | Q(texts__common_name__icontains=query, texts__language_id=LANGUAGE_ID)
+            ).distinct()
+            return [{"id": each.id, "active": site in each.site.all()} for each in species]
+
+        for query in ["ca", "phara", "lonista", "bush"]:
+            old = self.measure(f"'{query}', every match (old)", lambda: search_all(query))
+            new = self.measure(f"'{query}', trigram ranking (new)", lambda: search_species(query, site.id))
+            # There are no synonyms here, so every new result must be one of the old matches
+            matches = {each["id"]: each["active"] for each in old}
+            self.compare(min(len(old), AUTOCOMPLETE_LIMIT), len(new), f"Numbers of results for '{query}'")
+            self.compare(True, all(matches.get(each["id"]) == each["active"] for each in new), f"Results for '{query}'")
+
+    # The checks of the species spreadsheet preview on a sheet of --size rows (default 5000): mostly
+    # existing species, plus synonyms, new species, names without a species and empty rows, with 20000
+    # synonyms in the database. The old preview loaded every synonym and ran one exists() per row.
+    def species_preview(self, size):
+        size = size or 5000
+        genus = Genus.objects.create(name="Benchmarkia")
+        species = Species.objects.bulk_create([Species(name=f"Benchmarkia plant{count}", genus=genus) for count in range(size)], batch_size=1000)
+        SpeciesSynonym.objects.bulk_create([SpeciesSynonym(name=f"benchmarkia synonym{count}", species=random.choice(species)) for count in range(20000)], batch_size=5000)
+
+        rows = []
+        for count in range(size):
+            kind = random.choices(["existing", "synonym", "new", "invalid", "empty"], weights=[70, 10, 10, 5, 5])[0]
+            if kind == "existing":
+                rows.append(f" Benchmarkia plant{random.randrange(size)} ")
+            elif kind == "synonym":
+                rows.append(f"Benchmarkia Synonym{random.randrange(20000)}")
+            elif kind == "new":
+                rows.append(f"Benchmarkia novum{count}")
+            elif kind == "invalid":
+                rows.append("Benchmarkia")
+            else:
+                rows.append(None)
+        df = pd.DataFrame({"Name": rows})
+        self.stdout.write(f"{size} rows")
+
+        def check_per_row():
+            synonyms = dict(SpeciesSynonym.objects.values_list("name", "species__name"))
+            results = []
+            new_species = []
+            for index, row in df.iterrows():
+                name = row["Name"]
+                if pd.isna(name) or str(name).strip() == "":
+                    results.append("✖️")
+                    continue
+                name = str(name).strip()
+                exists = synonym = False
+                if len(name.split()) >= 2:
+                    if name.lower() in synonyms:
+                        name = synonyms[name.lower()]
+                        synonym = exists = True
+                    else:
+                        exists = Species.objects.filter(name=name).exists()
+                results.append("✓ SYN" if synonym else "✓" if exists else "✖️")
+                if not exists:
+                    new_species.append(name)
+            # Names without a species were listed as new as well, but are never imported
+            return results, [name for name in new_species if len(name.split()) >= 2]
+
+        # The same steps as the preview in controlpanel_document_species()
+        def check_in_bulk():
+            names, is_synonym, valid = normalize_species_names(df)
+            existing = Species.objects.filter(name__in=set(names[valid & ~is_synonym])).values_list("name", flat=True)
+            exists = valid & (is_synonym | names.isin(list(existing)))
+            results = pd.Series("✖️", index=df.index)
+            results[exists] = "✓"
+            results[valid & is_synonym] = "✓ SYN"
+            return results.tolist(), names[valid & ~exists].tolist()
+
+        old = self.measure("Query per row (old)", check_per_row)
+        new = self.measure("Two queries per sheet (new)", check_in_bulk)
+        self.compare(old, new, "Checks")
@@ -0,0 +1,80 @@
+from django.contrib.gis import geos
+from django.contrib.gis.db.models.functions import Transform
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from website.models import AnalysisCell, ReferenceSpace, ANALYSIS_BOUNDARY, ANALYSIS_LENGTH_LAYERS, get_analysis_layer_versions
+
+from collections import defaultdict
+import math
+
+# (Re)builds the analysis grid that is used by the site analysis report. All calculations
+# are done in web mercator (3857), which is also what the report uses for its 1km circle.
+class Command(BaseCommand):
+    help = "Build the precomputed analysis grid for the site analysis report"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=200, help="Cell size in meters")
+
+    def handle(self, *args, **options):
+        size = options["size"]
+
+        # Taken before reading the layers, so that a change made during the build makes the grid stale
+        layer_versions = get_analysis_layer_versions()
+
+        boundary = ReferenceSpace.objects.get(pk=ANALYSIS_BOUNDARY).geometry.transform(3857, clone=True)
+        prepared = boundary.prepared
+        x0, y0, xmax, ymax = boundary.extent
+        cols = math.ceil((xmax - x0) / size)
+        rows = math.ceil((ymax - y0) / size)
+
+        def cell_polygon(row, col):
+            x = x0 + col*size
+            y = y0 + row*size
+            polygon = geos.Polygon.from_bbox((x, y, x + size, y + size))
+            polygon.srid = 3857
+            return polygon
+
+        # Only keep the cells that actually touch the boundary
+        cells = {}
+        for row in range(rows):
+            for col in range(cols):
+                if prepared.intersects(cell_polygon(row, col)):
+                    cells[(row, col)] = defaultdict(float)
+        self.stdout.write(f"{len(cells)} cells of {size}m")
+
+        # Lines are clipped to every cell they cross so that the lengths add up exactly
+        for field, source in ANALYSIS_LENGTH_LAYERS.items():
+            lines = ReferenceSpace.objects.filter(source_id=source, geometry__isnull=False).annotate(
+                projected=Transform("geometry", 3857)
+            ).values_list("projected", flat=True)
+            for line in lines:
+                xmin, ymin, xmax, ymax = line.extent
+                prepared_line = line.prepared
+                for row in range(max(0, int((ymin - y0) // size)), min(rows, int((ymax - y0) // size) + 1)):
+                    for col in range(max(0, int((xmin - x0) // size)), min(cols, int((xmax - x0) // size) + 1)):
+                        if (row, col) not in cells:
+                            continue
+                        polygon = cell_polygon(row, col)
+                        if prepared_line.intersects(polygon):
+                            cells[(row, col)][field] += line.intersection(polygon).length
+
+        objects = []
+        for (row, col), values in cells.items():
+            polygon = cell_polygon(row, col)
+            polygon.transform(4326)
+            objects.append(AnalysisCell(
+                row=row,
+                col=col,
+                size=size,
+                geometry=polygon,
+                center=polygon.centroid,
+                **{field: values[field] for field in ANALYSIS_LENGTH_LAYERS},
+                layer_versions=layer_versions,
+            ))
+
+        with transaction.atomic():
+            AnalysisCell.objects.all().delete()
+            AnalysisCell.objects.bulk_create(objects, batch_size=2000)
+
+        self.stdout.write(self.style.SUCCESS(f"Saved {len(objects)} analysis cells"))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from website.models import Garden, GardenScore, GardenSpecies
+from website.scoring import refresh_garden_score
+
+# Recalculates the stored score snapshots of all gardens. Run this after changing
+# the scoring rules, or to fill the snapshots for the first time.
+class Command(BaseCommand):
+    help = "Rebuild the stored garden score snapshots"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--site", type=int, help="Only rebuild gardens of this site id")
+        parser.add_argument("--stale", action="store_true", help="Only rebuild snapshots that are stale or missing")
+
+    def handle(self, *args, **options):
+        gardens = Garden.objects_unfiltered.filter(plants__isnull=False).distinct().select_related("vegetation_type")
+        if options["site"]:
+            gardens = gardens.filter(site_id=options["site"])
+
+        fresh = set()
+        if options["stale"]:
+            fresh = set(GardenScore.objects.filter(is_stale=False).values_list("garden_id", "status"))
+
+        # Gardens without any plants simply have no score
+        empty = Garden.objects_unfiltered.filter(plants__isnull=True)
+        if options["site"]:
+            empty = empty.filter(site_id=options["site"])
+        GardenScore.objects.filter(garden__in=empty).update(scores=None, is_stale=False)
+
+        count = 0
+        for garden in gardens.iterator(chunk_size=200):
+            for status, label in GardenSpecies.STATUS_OPTIONS:
+                if (garden.id, status) in fresh:
+                    continue
+                try:
+                    refresh_garden_score(garden, status)
+                    count += 1
+                except Exception as e:
+                    self.stderr.write(f"Unable to score garden {garden.id} ({status}): {e}")
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} garden score snapshots"))
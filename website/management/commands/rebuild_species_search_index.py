@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from website.models import SpeciesSearchIndex, refresh_species_search_index
+
+# Rebuilds the species search index from scratch. The index is kept up to date by signals, but
+# bulk changes (e.g. queryset.update() or bulk_create()) bypass those, so run this afterwards.
+class Command(BaseCommand):
+    help = "Rebuild the species search index"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            SpeciesSearchIndex.objects.all().delete()
+            count = refresh_species_search_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} species"))
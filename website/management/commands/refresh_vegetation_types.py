@@ -0,0 +1,40 @@
+from django.contrib.gis.db.models.functions import Centroid
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from website.models import Garden, VegetationType, VEGETATION_MAP, mark_garden_scores_stale
+
+# Recalculates the vegetation type of all gardens. Rather than saving every garden (one
+# spatial query each), the vegetation type is worked out for all gardens at once with a
+# single spatial join against the vegetation map of their site.
+class Command(BaseCommand):
+    help = "Recalculate the vegetation type of all gardens"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--site", type=int, help="Only refresh gardens of this site id")
+
+    def handle(self, *args, **options):
+        located = VegetationType.spaces.through.objects.filter(
+            referencespace__source_id=Coalesce(OuterRef("site__vegetation_types_map_id"), Value(VEGETATION_MAP)),
+            referencespace__geometry__intersects=Centroid(OuterRef("geometry")),
+        ).order_by("referencespace_id").values("vegetationtype_id")[:1]
+
+        # Gardens outside of the map get the first vegetation type of their site, same as Garden.save()
+        default = VegetationType.objects.filter(site=OuterRef("site"), is_negative=False).values("id")[:1]
+
+        gardens = Garden.objects_unfiltered.annotate(
+            new_vegetation_type_id=Coalesce(Subquery(located), Subquery(default))
+        )
+        if options["site"]:
+            gardens = gardens.filter(site_id=options["site"])
+
+        changed = []
+        for id, current, new in gardens.values_list("id", "vegetation_type_id", "new_vegetation_type_id"):
+            if current != new:
+                changed.append(Garden(id=id, vegetation_type_id=new))
+
+        Garden.objects_unfiltered.bulk_update(changed, ["vegetation_type"], batch_size=500)
+        mark_garden_scores_stale(garden_id__in=[garden.id for garden in changed])
+
+        self.stdout.write(self.style.SUCCESS(f"Updated the vegetation type of {len(changed)} gardens"))
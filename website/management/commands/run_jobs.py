@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from website.models import Job
+
+import time
+
+# Worker for the Job queue. Keep this running next to the web server (e.g. as a separate
+# container or systemd service); more than one worker can run at the same time.
+class Command(BaseCommand):
+    help = "Process queued background jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Process all pending jobs and then stop")
+        parser.add_argument("--sleep", type=int, default=5, help="Seconds to wait when there are no jobs")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            job = Job.claim()
+            if not job:
+                if options["once"]:
+                    break
+                time.sleep(options["sleep"])
+                continue
+
+            self.stdout.write(f"Running job {job.id}: {job}")
+            job.run()
+            if job.status == Job.Status.FAILED:
+                self.stderr.write(f"Job {job.id} failed: {job.message}")
+            else:
+                self.stdout.write(self.style.SUCCESS(f"Job {job.id} completed: {job.message}"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from website.models import Document, Garden, simplify_garden_geometry
+
+# Regenerates the simplified geometries that the maps use at lower zoom levels, for
+# instance after changing the tolerances in SimplifiedGeometry.
+class Command(BaseCommand):
+    help = "Regenerate the simplified geometries of all shapefile spaces"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--document", type=int, help="Only regenerate the spaces of this document id")
+
+    def handle(self, *args, **options):
+        documents = Document.objects.filter(is_shapefile=True, spaces__isnull=False).distinct()
+        if options["document"]:
+            documents = documents.filter(pk=options["document"])
+
+        for document in documents:
+            document.simplify_spaces()
+            document.save()
+            document.bump_spaces_version()
+            self.stdout.write(f"Simplified {document}")
+
+        # Gardens are not necessarily linked to a document so we do those separately
+        if not options["document"]:
+            for garden in Garden.objects_unfiltered.filter(geometry__isnull=False):
+                simplify_garden_geometry(Garden, garden)
+
+        self.stdout.write(self.style.SUCCESS(f"Simplified the spaces of {documents.count()} documents"))
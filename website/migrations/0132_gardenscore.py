@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-18 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0131_garden_garden_number'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GardenScore',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PRESENT', 'Currently present'), ('FUTURE', 'Future wish-list')], db_index=True, max_length=10)),
+                ('scores', models.JSONField(blank=True, null=True)),
+                ('is_stale', models.BooleanField(db_index=True, default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('garden', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='score_snapshots', to='website.garden')),
+            ],
+            options={
+                'unique_together': {('garden', 'status')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-18 10:03
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0132_gardenscore'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisCell',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row', models.PositiveIntegerField()),
+                ('col', models.PositiveIntegerField()),
+                ('size', models.PositiveIntegerField(help_text='Width/height of the cell in meters (web mercator)')),
+                ('geometry', django.contrib.gis.db.models.fields.PolygonField(srid=4326)),
+                ('center', django.contrib.gis.db.models.fields.PointField(srid=4326)),
+                ('schools', models.PositiveIntegerField(default=0)),
+                ('cemeteries', models.PositiveIntegerField(default=0)),
+                ('parks', models.PositiveIntegerField(default=0)),
+                ('centers', models.PositiveIntegerField(default=0)),
+                ('remnants', models.PositiveIntegerField(default=0)),
+                ('gardens', models.PositiveIntegerField(default=0)),
+                ('river_length', models.FloatField(default=0)),
+                ('railway_length', models.FloatField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('row', 'col')},
+            },
+        ),
+    ]
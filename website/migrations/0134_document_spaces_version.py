@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0133_analysiscell'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='spaces_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='spaces_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 6.0 on 2026-10-18 12:41
+
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0134_document_spaces_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimplifiedGeometry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.PositiveSmallIntegerField(choices=[(1, 'Low detail'), (2, 'Medium detail'), (3, 'High detail')])),
+                ('geometry', django.contrib.gis.db.models.fields.GeometryField(srid=4326)),
+                ('space', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='simplified_geometries', to='website.referencespace')),
+            ],
+            options={
+                'unique_together': {('space', 'level')},
+            },
+        ),
+    ]
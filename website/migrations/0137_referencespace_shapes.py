@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-18 15:05
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0136_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='referencespace',
+            name='centroid',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='referencespace',
+            name='bbox',
+            field=django.contrib.gis.db.models.fields.GeometryField(blank=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='referencespace',
+            name='area',
+            field=models.FloatField(blank=True, help_text='In m2, measured in an equal-area projection (6933)', null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-18 15:06
+
+from django.contrib.gis.db.models.functions import Area, Centroid, Envelope, Transform
+from django.db import migrations
+
+
+def backfill_shapes(apps, schema_editor):
+    ReferenceSpace = apps.get_model('website', 'ReferenceSpace')
+    ReferenceSpace.objects.filter(geometry__isnull=False).update(
+        centroid=Centroid('geometry'),
+        bbox=Envelope('geometry'),
+        area=Area(Transform('geometry', 6933)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0137_referencespace_shapes'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_shapes, migrations.RunPython.noop),
+    ]
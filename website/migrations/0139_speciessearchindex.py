@@ -0,0 +1,58 @@
+# Generated by Django 6.0 on 2026-10-18 16:20
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Fills the search index for the existing species, the same way refresh_species_search_index() does
+POPULATE_SQL = """
+INSERT INTO website_speciessearchindex
+    (species_id, site_ids, feature_ids, color_ids, vegetation_type_ids, nursery_ids, in_stock_nursery_ids, source_ids)
+SELECT
+    s.id,
+    ARRAY(SELECT DISTINCT site_id FROM website_species_site WHERE species_id = s.id),
+    ARRAY(SELECT DISTINCT speciesfeatures_id FROM website_species_features WHERE species_id = s.id),
+    ARRAY(SELECT DISTINCT color_id FROM website_species_colors WHERE species_id = s.id),
+    ARRAY(SELECT DISTINCT vegetationtype_id FROM website_species_vegetation_types WHERE species_id = s.id),
+    ARRAY(SELECT DISTINCT nursery_id FROM website_nurseryinventory WHERE species_id = s.id),
+    ARRAY(SELECT DISTINCT nursery_id FROM website_nurseryinventory WHERE species_id = s.id AND in_stock),
+    ARRAY(SELECT DISTINCT a.attached_to_id FROM website_filelog l JOIN website_attachment a ON a.id = l.file_id WHERE l.species_id = s.id)
+FROM website_species s
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0138_backfill_referencespace_shapes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpeciesSearchIndex',
+            fields=[
+                ('species', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_index', serialize=False, to='website.species')),
+                ('site_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+                ('feature_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+                ('color_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+                ('vegetation_type_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+                ('nursery_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+                ('in_stock_nursery_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+                ('source_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+            ],
+            options={
+                'indexes': [
+                    django.contrib.postgres.indexes.GinIndex(fields=['site_ids'], name='species_search_sites'),
+                    django.contrib.postgres.indexes.GinIndex(fields=['feature_ids'], name='species_search_features'),
+                    django.contrib.postgres.indexes.GinIndex(fields=['color_ids'], name='species_search_colors'),
+                    django.contrib.postgres.indexes.GinIndex(fields=['vegetation_type_ids'], name='species_search_vegtypes'),
+                    django.contrib.postgres.indexes.GinIndex(fields=['nursery_ids'], name='species_search_nurseries'),
+                    django.contrib.postgres.indexes.GinIndex(fields=['in_stock_nursery_ids'], name='species_search_in_stock'),
+                    django.contrib.postgres.indexes.GinIndex(fields=['source_ids'], name='species_search_sources'),
+                ],
+            },
+        ),
+        migrations.RunSQL(POPULATE_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-18 17:10
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0139_speciessearchindex'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='species',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='species_name_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='speciestext',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('common_name'), name='gin_trgm_ops'), name='speciestext_common_name_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='speciessynonym',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='speciessynonym_name_trgm'),
+        ),
+    ]
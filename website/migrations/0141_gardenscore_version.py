@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-18 19:25
+
+from django.db import migrations, models
+
+
+# Existing snapshots are keyed by translated labels; they are recalculated with the new keys
+def mark_snapshots_stale(apps, schema_editor):
+    GardenScore = apps.get_model('website', 'GardenScore')
+    GardenScore.objects.update(is_stale=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0140_species_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gardenscore',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(mark_snapshots_stale, migrations.RunPython.noop),
+    ]
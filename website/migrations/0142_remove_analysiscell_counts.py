@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-18 20:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0141_gardenscore_version'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='analysiscell',
+            name='schools',
+        ),
+        migrations.RemoveField(
+            model_name='analysiscell',
+            name='cemeteries',
+        ),
+        migrations.RemoveField(
+            model_name='analysiscell',
+            name='parks',
+        ),
+        migrations.RemoveField(
+            model_name='analysiscell',
+            name='centers',
+        ),
+        migrations.RemoveField(
+            model_name='analysiscell',
+            name='remnants',
+        ),
+        migrations.RemoveField(
+            model_name='analysiscell',
+            name='gardens',
+        ),
+    ]
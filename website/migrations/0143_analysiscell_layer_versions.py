@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 20:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0142_remove_analysiscell_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysiscell',
+            name='layer_versions',
+            field=models.JSONField(default=dict, help_text='The spaces_version of each line layer at the time the grid was built'),
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='job_type',
+            field=models.CharField(choices=[('convert_shapefile', 'Import shapefile'), ('shapefile_plot', 'Create shapefile plot'), ('clip_spaces', 'Clip spaces'), ('build_analysis_grid', 'Build analysis grid')], db_index=True, max_length=50),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0143_analysiscell_layer_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='vegetation_types_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
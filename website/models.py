@@ -12,12 +12,23 @@ from django.urls import reverse
 import uuid
 from django.utils.translation import gettext_lazy as _
 import os
-from django.db.models.signals import post_delete
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
-from django.db.models import Q, UniqueConstraint
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Q, UniqueConstraint, OuterRef, Subquery, F, Prefetch, Window
+from django.db.models.functions import Coalesce, RowNumber, Upper
+from django.contrib.gis.db.models.functions import GeomOutputGeoFunc, Area, Centroid, Envelope, Transform
+import copy
 import datetime
+import numpy as np
 import requests
+import threading
+import time
+from contextlib import contextmanager
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.expressions import ArraySubquery
+from django.contrib.postgres.indexes import GinIndex, OpClass
 import xml.etree.ElementTree as ET
 import zipfile
 from django.contrib.gis import geos
@@ -103,6 +114,72 @@ class Site(models.Model):
     def lng(self):
         return self.meta_data["lng"]
 
+# Every request needs the Site (and the nursery menu), so we keep a process-wide cache of them.
+# The key is either "id:<pk>" (when the site cookie is set) or the lowercased HTTP host.
+# Entries expire after SITE_CACHE_TIMEOUT seconds so that other worker processes, which do not
+# receive our post_save/post_delete signals, also pick up changes eventually.
+SITE_CACHE_TIMEOUT = 300
+SITE_CACHE = {}
+NURSERY_CACHE = {}
+
+def _from_site_cache(cache, key, load):
+    now = time.monotonic()
+    hit = cache.get(key)
+    if hit and now - hit[0] < SITE_CACHE_TIMEOUT:
+        return hit[1]
+    value = load()
+    cache[key] = (now, value)
+    return value
+
+def get_site_for_request(request):
+    # Memoized on the request, so that get_site() in the views and the site() context
+    # processor share one lookup. Raises Site.DoesNotExist, like Site.objects.get() did.
+    if hasattr(request, "_site"):
+        return request._site
+
+    site_id = request.COOKIES.get("site")
+    if site_id:
+        key = f"id:{site_id}"
+        load = lambda: Site.objects.get(pk=site_id)
+    else:
+        url = request.META.get("HTTP_HOST").lower()
+        key = url
+        load = lambda: Site.objects.get(url=url)
+
+    # We hand out a copy so that views that modify the site (e.g. the meta_data) without
+    # saving it do not leak those changes into other requests
+    site = copy.deepcopy(_from_site_cache(SITE_CACHE, key, load))
+    request._site = site
+    return site
+
+def get_site_nurseries(site):
+    return _from_site_cache(NURSERY_CACHE, site.id, lambda: list(
+        Page.objects.filter(site=site, page_type=Page.PageType.NURSERY)
+    ))
+
+def clear_site_cache():
+    SITE_CACHE.clear()
+    NURSERY_CACHE.clear()
+
+# Version counters for cached data that is built from many tables. The Django cache is not shared
+# between worker processes, so deleting a key only helps the process that handled the change.
+# Instead, cache keys include one of these versions and a change bumps it in the database.
+class CacheVersion(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} ({self.version})"
+
+    @classmethod
+    def get(cls, name):
+        return cls.objects.filter(name=name).values_list("version", flat=True).first() or 0
+
+    @classmethod
+    def bump(cls, name):
+        if not cls.objects.filter(name=name).update(version=F("version")+1):
+            cls.objects.get_or_create(name=name, defaults={"version": 1})
+
 class Page(models.Model):
     name = models.CharField(max_length=255, db_index=True)
     content = models.TextField(null=True, blank=True)
@@ -212,6 +289,12 @@ class Page(models.Model):
             self.slug = slugify(unidecode(self.name))
         super().save(*args, **kwargs)
 
+# Any change to a site or to its pages (e.g. the nurseries in the menu) invalidates the site cache
+@receiver([post_save, post_delete], sender=Site)
+@receiver([post_save, post_delete], sender=Page)
+def invalidate_site_cache(sender, instance, **kwargs):
+    clear_site_cache()
+
 class Organization(models.Model):
     name = models.CharField(max_length=255, db_index=True)
     description = models.TextField(null=True, blank=True)
@@ -225,6 +308,12 @@ class Organization(models.Model):
     class Meta:
         ordering = ["name"]
 
+# Shapefiles with more features than this need to be approved by an administrator (skip_size_check)
+SHAPEFILE_SIZE_CHECK = 250000
+
+# Number of features that are written to the database at once when importing a shapefile
+IMPORT_CHUNK_SIZE = 2000
+
 class Document(models.Model):
     name = models.CharField(max_length=255, db_index=True)
     DOC_TYPES = {
@@ -253,9 +342,49 @@ class Document(models.Model):
 
     temp_file = models.CharField(max_length=255, null=True, blank=True)
 
+    # Bumped whenever the spaces of this document change, used to cache the geojson layer
+    spaces_version = models.PositiveIntegerField(default=0)
+    spaces_updated_at = models.DateTimeField(null=True, blank=True)
+    # Bumped whenever the vegetation types change, for documents that are used as vegetation map. This is
+    # kept apart from spaces_version so that the cached layers and tiles of the map stay valid.
+    vegetation_types_version = models.PositiveIntegerField(default=0)
+
     def __str__(self):
         return self.name
 
+    # (Re)creates the simplified geometries of all spaces of this document, and stores the size
+    # and the time it takes to load/serialize the layer at each level in the meta data so that
+    # we can show that in the control panel. The caller needs to save the document.
+    def simplify_spaces(self):
+        spaces = ReferenceSpace.objects.filter(source=self, geometry__isnull=False)
+        SimplifiedGeometry.objects.filter(space__source=self).delete()
+        for level, tolerance in SimplifiedGeometry.TOLERANCE.items():
+            rows = spaces.annotate(simplified=SimplifyPreserveTopology("geometry", tolerance)).values_list("id", "simplified")
+            SimplifiedGeometry.objects.bulk_create([
+                SimplifiedGeometry(space_id=id, level=level, geometry=geometry) for id, geometry in rows if geometry
+            ], batch_size=1000)
+
+        report = []
+        for level, label in [(None, "Full detail")] + SimplifiedGeometry.Level.choices:
+            start = time.perf_counter()
+            size = 0
+            for geometry in with_simplified_geometry(spaces, level).values_list("map_geometry", flat=True):
+                if geometry:
+                    size += len(geometry.json)
+            report.append({
+                "level": str(label),
+                "size": size,
+                "time": round((time.perf_counter()-start)*1000),
+            })
+
+        if not self.meta_data:
+            self.meta_data = {}
+        self.meta_data["simplification"] = report
+
+    def bump_spaces_version(self):
+        bump_spaces_version(self.id)
+        self.refresh_from_db(fields=["spaces_version", "spaces_updated_at"])
+
     def get_file_size(self):    
         if self.file:
             return self.file.size/1024/1024
@@ -278,6 +407,18 @@ class Document(models.Model):
         except:
             return 0.4 # Default background color opacity in the maps
 
+    # Large layers can be shown as vector tiles instead of one big geojson file (see views.tiles).
+    # To enable this, set "vector_tiles": true in the meta data.
+    @property
+    def use_vector_tiles(self):
+        return bool(self.meta_data and self.meta_data.get("vector_tiles"))
+
+    # The tile url for Leaflet, with {z}/{x}/{y} placeholders. Those can't be reversed (the url only takes
+    # numbers), so we reverse the first tile and swap its coordinates for the placeholders.
+    def get_tiles_url(self):
+        url = reverse("tiles", args=[self.id, 0, 0, 0]).replace("/0/0/0.mvt", "/{z}/{x}/{y}.mvt")
+        return f"{url}?v={self.spaces_version}"
+
     # Shortcut to make it easier to access the properties
     @property
     def shpinfo(self):
@@ -316,168 +457,39 @@ class Document(models.Model):
         self.save()
         return True
 
-    def convert_shapefile(self):
+    # Replaces the spaces of this document with the features of its shapefile. This all happens in a
+    # single transaction, so if the import fails the layer stays as it was. Progress is an optional
+    # function that is called with (processed, total) while importing.
+    def convert_shapefile(self, progress=None):
         layer = self.get_gis_layer()
-        fields = layer.fields
         total_count = layer.num_feat
-        shapefile_type = layer.geom_type.name
         error = None
 
-        if total_count > 1000 and not self.meta_data.get("skip_size_check"):
+        if total_count > SHAPEFILE_SIZE_CHECK and not self.meta_data.get("skip_size_check"):
             error = "This file has too many objects. It needs to be verified by an administrator in order to be fully loaded into the system."
-        elif "single_reference_space" in self.meta_data:
-            # EXAMPLE: a shapefile containing all the water reticulation (piping) in the city
-            # This is one single space, so we do not loop but instead create a single item
-            # To do that, we get all the geos with get_geoms
-            # (https://docs.djangoproject.com/en/3.1/ref/contrib/gis/gdal/#django.contrib.gis.gdal.Layer.get_geoms)
-            # and then we loop over THOSE, and combine them, using the union function
-            # (https://docs.djangoproject.com/en/3.1/ref/contrib/gis/geos/#django.contrib.gis.geos.GEOSGeometry.union)
-            polygon = None
-            ct = None
-            if layer.srs.srid != 4326:
-                # If this isn't WGS 84 then we need to convert the crs to this one
-                try:
-                    ct = CoordTransform(layer.srs, SpatialReference("WGS84"))
-                except Exception as e:
-                    error = "The following error occurred when trying to change the coordinate reference system: " + str(e)
-
-            if not error:
-                try:
-                    for each in layer.get_geoms(True):
-                        try:
-                            if ct:
-                                each.transform(ct)
-                        except Exception as e:
-                            error = "The following error occurred when trying to fetch the shapefile info: " + str(e)
-
-                        if not polygon:
-                            polygon = each
-                        else:
-                            try:
-                                polygon = polygon.union(each)
-                            except Exception as e:
-                                error = "The following error occurred when trying to merge geometries: " + str(e)
-                except Exception as e:
-                    error = "The following error occurred when trying to get all the geometries: " + str(e)
-
-            if not error:
-
-                if shapefile_type == "Point25D" or shapefile_type == "LineString25D" or shapefile_type == "Polygon25D":
-                    # This type has a "Z" geometry which needs to be changed to a 2-dimensional geometry
-                    # See also https://stackoverflow.com/questions/35851577/strip-z-dimension-on-geodjango-force-2d-geometry
-                    get_clone = polygon.clone()
-                    polygon.coord_dim = 2
-                    polygon = get_clone
-
-                if polygon.hasz:
-                    # Oddly enough the code above does not always work. Not yet sure why. I have had lines that were combined,
-                    # into a multilinestring, and it seems like it is not possible (for Django?) to remove 3D from this
-                    # kind of object. So we simply do another check to see if it 'has z'. BTW we can likely use hasz
-                    # instead of shapefile_type == point25d etc but I only now learned about it. Something for later.
-                    # https://docs.djangoproject.com/en/3.1/ref/contrib/gis/geos/#django.contrib.gis.geos.GEOSGeometry.hasz
-                    error = "This shapefile includes data in 3D. We only store shapefiles with 2D data. Please remove the elevation data (Z coordinates). This can be done, for instance, using QGIS: https://docs.qgis.org/testing/en/docs/user_manual/processing_algs/qgis/vectorgeometry.html#drop-m-z-values"
+        else:
+            with transaction.atomic():
+                self.spaces.all().delete()
+                if "single_reference_space" in self.meta_data:
+                    # EXAMPLE: a shapefile containing all the water reticulation (piping) in the city
+                    # This is one single space, so we do not loop but instead create a single item
+                    error = self.import_unions(layer, group_by_name=False)
+                elif "group_spaces_by_name" in self.meta_data:
+                    # EXAMPLE: a shapefile containing land use data, in which there are many polygons indicating
+                    # a few different types (e.g. BUILT ENVIRONMENT, LAKES, AGRICULTURE). These should be saved
+                    # as individual reference spaces (so we can differentiate them), grouped by their name
+                    error = self.import_unions(layer, group_by_name=True)
                 else:
-                    space = ReferenceSpace.objects.create(
-                        name = self.name,
-                        geometry = polygon,
-                        source = self,
-                    )
-        elif "group_spaces_by_name" in self.meta_data:
-            # EXAMPLE: a shapefile containing land use data, in which there are many polygons indicating
-            # a few different types (e.g. BUILT ENVIRONMENT, LAKES, AGRICULTURE). These should be saved
-            # as individual reference spaces (so we can differentiate them), grouped by their name
-            spaces = {}
-            for each in layer:
-
-                try:
-                    if shapefile_type == "Point25D" or shapefile_type == "LineString25D" or shapefile_type == "Polygon25D":
-                        # This type has a "Z" geometry which needs to be changed to a 2-dimensional geometry
-                        # See also https://stackoverflow.com/questions/35851577/strip-z-dimension-on-geodjango-force-2d-geometry
-                        get_clone = each.geom.clone()
-                        get_clone.coord_dim = 2
-                        geo = get_clone
-                    else:
-                        geo = each.geom
-                except Exception as e:
-                    error = "The following error occurred when trying to prepare the shapefile element: " + str(e)
-
-                # We use WGS 84 (4326) as coordinate reference system, so we gotta convert to that
-                # if it uses something else
-                if layer.srs.srid != 4326:
-                    try:
-                        ct = CoordTransform(layer.srs, SpatialReference("WGS84"))
-                        geo.transform(ct)
-                    except Exception as e:
-                        error = "The following error occurred when trying to change the coordinate reference system: " + str(e)
-
-                name = each.get(self.meta_data["columns"]["name"])
-                if not name:
-                    name = _("Unnamed")
+                    error = self.import_features(layer, progress)
 
-                # So what we do here is to check if this particular field (based on the name) already exists
-                # If not, we create a new space in our dictionary with the geometry of this one.
-                if name not in spaces:
-                    spaces[name] = geo
+                if error:
+                    transaction.set_rollback(True)
                 else:
-                    # However, if it already exists then we use the union function to merge the geometry of this space
-                    # with the existing info
-                    try:
-                        s = spaces[name]
-                        spaces[name] = s.union(geo)
-                    except Exception as e:
-                        error = "The following error occurred when trying to merge geometries: " + str(e)
-
-            if not error:
-                for name,geo in spaces.items():
-                    ReferenceSpace.objects.create(
-                        name = name,
-                        geometry = geo.wkt,
-                        source = self,
-                    )
-        else:
-            count = 0
-            for each in layer:
-                count += 1
-                meta_data = {}
-
-                # We'll get all the properties and we store this in the meta data of the new object
-                for f in fields:
-                    # We can't save datetime objects in json, so if it's a datetime then we convert to string
-                    if f in self.meta_data["columns"]["import"]:
-                        meta_data[f] = str(each.get(f)) if isinstance(each.get(f), datetime.date) else each.get(f)
-
-                name = each.get(self.meta_data["columns"]["name"])
-
-                try:
-                    if shapefile_type == "Point25D" or shapefile_type == "LineString25D" or shapefile_type == "Polygon25D":
-                        # This type has a "Z" geometry which needs to be changed to a 2-dimensional geometry
-                        # See also https://stackoverflow.com/questions/35851577/strip-z-dimension-on-geodjango-force-2d-geometry
-                        get_clone = each.geom.clone()
-                        get_clone.coord_dim = 2
-                        geo = get_clone
-                    else:
-                        geo = each.geom
-                except Exception as e:
-                    error = "The following error occurred when trying to obtain the shapefile geometry: " + str(e)
-
-                # We use WGS 84 (4326) as coordinate reference system, so we gotta convert to that
-                # if it uses something else
-                if layer.srs.srid != 4326:
-                    try:
-                        ct = CoordTransform(layer.srs, SpatialReference("WGS84"))
-                        geo.transform(ct)
-                    except Exception as e:
-                        error = "The following error occurred when trying to convert the coordinate reference system to WGS84: " + str(e)
-
-                if not error:
-                    geo = geo.wkt
-                    space = ReferenceSpace.objects.create(
-                        name = name,
-                        geometry = geo,
-                        source = self,
-                        meta_data = {"features": meta_data},
-                    )
+                    update_space_shapes(ReferenceSpace.objects.filter(source=self))
+                    self.simplify_spaces()
 
+        if not error:
+            self.bump_spaces_version()
         self.meta_data["processing_date"] = str(timezone.now())
         if error:
             self.meta_data["processing_error"] = error
@@ -489,6 +501,146 @@ class Document(models.Model):
 
         return True
 
+    # Merges the features of the layer into a single reference space, or into one space per name. Rather
+    # than merging the geometries one by one (which gets slower with every feature that is added), we first
+    # collect all geometries of a group and then merge them with a single unary union.
+    # Returns an error message, or None if all went well.
+    def import_unions(self, layer, group_by_name):
+        ct = None
+        if layer.srs and layer.srs.srid != 4326:
+            try:
+                ct = CoordTransform(layer.srs, SpatialReference("WGS84"))
+            except Exception as e:
+                return "The following error occurred when trying to change the coordinate reference system: " + str(e)
+
+        groups = {}
+        for each in layer:
+            try:
+                geo = each.geom
+                if geo.is_3d:
+                    # We only store 2D data, so any "Z" coordinates are dropped
+                    geo.set_3d(False)
+                if ct:
+                    geo.transform(ct)
+                geo = geo.geos
+            except Exception as e:
+                return "The following error occurred when trying to prepare the shapefile element: " + str(e)
+
+            if group_by_name:
+                name = each.get(self.meta_data["columns"]["name"])
+                if not name:
+                    name = str(_("Unnamed"))
+            else:
+                name = self.name
+            groups.setdefault(name, []).append(geo)
+
+        spaces = []
+        for name, geometries in groups.items():
+            try:
+                if len(geometries) == 1:
+                    geometry = geometries[0]
+                else:
+                    geometry = geos.GeometryCollection(geometries).unary_union
+            except Exception as e:
+                return "The following error occurred when trying to merge geometries: " + str(e)
+            geometry.srid = 4326
+            spaces.append(ReferenceSpace(name=name, geometry=geometry, source=self))
+
+        ReferenceSpace.objects.bulk_create(spaces)
+
+    # Imports every feature of the layer as a separate reference space. The layer is read feature by feature
+    # and written in chunks with bulk_create, reporting the progress after every chunk. This runs inside the
+    # transaction of convert_shapefile(). Returns an error message, or None if all went well.
+    def import_features(self, layer, progress=None):
+        fields = layer.fields
+        import_columns = self.meta_data["columns"]["import"]
+        name_column = self.meta_data["columns"]["name"]
+        total_count = layer.num_feat
+
+        # We use WGS 84 (4326) as coordinate reference system, so we gotta convert to that
+        # if it uses something else. The same transformation is used for all features.
+        ct = None
+        if layer.srs and layer.srs.srid != 4326:
+            try:
+                ct = CoordTransform(layer.srs, SpatialReference("WGS84"))
+            except Exception as e:
+                return "The following error occurred when trying to convert the coordinate reference system to WGS84: " + str(e)
+
+        def save_chunk(chunk, processed):
+            ReferenceSpace.objects.bulk_create(chunk, batch_size=IMPORT_CHUNK_SIZE)
+            if progress:
+                progress(processed, total_count)
+
+        error = None
+        chunk = []
+        processed = 0
+        for each in layer:
+            meta_data = {}
+
+            # We'll get all the properties and we store this in the meta data of the new object
+            for f in fields:
+                # We can't save datetime objects in json, so if it's a datetime then we convert to string
+                if f in import_columns:
+                    value = each.get(f)
+                    meta_data[f] = str(value) if isinstance(value, datetime.date) else value
+
+            try:
+                geo = each.geom
+                if geo.is_3d:
+                    # Some shapefiles have a "Z" geometry which needs to be changed to a 2-dimensional geometry
+                    geo.set_3d(False)
+                if ct:
+                    geo.transform(ct)
+                geo = geo.geos
+                geo.srid = 4326
+            except Exception as e:
+                error = "The following error occurred when trying to obtain the shapefile geometry: " + str(e)
+                break
+
+            chunk.append(ReferenceSpace(
+                name = each.get(name_column),
+                geometry = geo,
+                source = self,
+                meta_data = {"features": meta_data},
+            ))
+            processed += 1
+
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                save_chunk(chunk, processed)
+                chunk = []
+
+        if chunk or not processed:
+            save_chunk(chunk, processed)
+
+        return error
+
+    # Removes all spaces that are outside the boundaries of the given space, and cuts off
+    # those that cross the boundaries. Returns the number of removed and clipped spaces.
+    def clip_spaces(self, clip_boundaries, progress=None):
+        self.meta_data["clip"] = str(clip_boundaries.id)
+        self.save()
+
+        # First we delete the spaces that are outside the clipped area
+        spaces = self.spaces.exclude(Q(geometry__within=clip_boundaries.geometry)|Q(geometry__intersects=clip_boundaries.geometry))
+        total_to_delete = int(spaces.count())
+        spaces.delete()
+
+        # And then we cut off those that cross boundaries
+        intersecting = self.spaces.filter(geometry__intersects=clip_boundaries.geometry)
+        total_to_clip = intersecting.count()
+        with spaces_version_batch():
+            for count, each in enumerate(intersecting, start=1):
+                sliced_geometry = each.geometry.intersection(clip_boundaries.geometry)
+                each.geometry = sliced_geometry
+                each.save()
+                if progress and count % 100 == 0:
+                    progress(count, total_to_clip)
+
+        self.simplify_spaces()
+        self.save()
+        self.bump_spaces_version()
+        return total_to_delete, total_to_clip
+
     def create_shapefile_plot(self):
         success = False
         if not self.meta_data:
@@ -522,6 +674,55 @@ class Document(models.Model):
             self.save()
         return True if success else False
 
+# We use an UPDATE so that the version is always increased, even if an older instance of the document is around
+def bump_spaces_version(document_id):
+    Document.objects.filter(pk=document_id).update(spaces_version=models.F("spaces_version")+1, spaces_updated_at=timezone.now())
+    VegetationLocator.invalidate(document_id)
+    if document_id in ANALYSIS_LENGTH_LAYERS.values():
+        queue_analysis_grid_build()
+
+# Spaces are saved and deleted all over the place (garden forms, the admin, the control panel), so
+# the receivers further down bump the version of their document. Those bumps are coalesced: inside
+# a transaction they are done once per document when it commits, and inside spaces_version_batch()
+# once per document when the block ends. Use the latter for loops that save many spaces.
+_spaces_version_state = threading.local()
+
+@contextmanager
+def spaces_version_batch():
+    _spaces_version_state.batch = set()
+    try:
+        yield
+    finally:
+        document_ids = _spaces_version_state.batch
+        _spaces_version_state.batch = None
+        for document_id in document_ids:
+            bump_spaces_version(document_id)
+
+def bump_spaces_version_on_commit(document_id):
+    batch = getattr(_spaces_version_state, "batch", None)
+    if batch is not None:
+        batch.add(document_id)
+        return
+
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        bump_spaces_version(document_id)
+        return
+
+    # Django starts a new list of commit hooks when a rollback discards the old ones, so if the list has
+    # changed, the transaction we registered with is over without having run our hook
+    pending = getattr(_spaces_version_state, "pending", None)
+    if pending is None or pending[0] is not connection.run_on_commit:
+        document_ids = set()
+        pending = _spaces_version_state.pending = (connection.run_on_commit, document_ids)
+
+        def bump_pending():
+            _spaces_version_state.pending = None
+            for id in document_ids:
+                bump_spaces_version(id)
+        transaction.on_commit(bump_pending)
+    pending[1].add(document_id)
+
 class Attachment(models.Model):
     file = models.FileField(upload_to="files")
     attached_to = models.ForeignKey("Document", on_delete=models.CASCADE, related_name="attachments")
@@ -559,9 +760,32 @@ class ReferenceSpace(models.Model):
     source = models.ForeignKey(Document, on_delete=models.CASCADE, null=True, blank=True, related_name="spaces")
     meta_data = models.JSONField(null=True, blank=True)
 
+    # These are derived from the geometry and kept up to date in save() and update_space_shapes(),
+    # so that we can place markers and show sizes without loading the full geometry
+    centroid = models.PointField(null=True, blank=True)
+    bbox = models.GeometryField(null=True, blank=True) # The envelope, which is a point for points
+    area = models.FloatField(null=True, blank=True, help_text="In m2, measured in an equal-area projection (6933)")
+
     def __str__(self):
         return self.name if self.name else str(_("Unnamed object"))
 
+    def set_shapes(self):
+        if self.geometry:
+            self.centroid = self.geometry.centroid
+            self.bbox = self.geometry.envelope
+            self.area = self.geometry.transform(AREA_SRID, clone=True).area
+        else:
+            self.centroid = self.bbox = self.area = None
+
+    def save(self, *args, **kwargs):
+        # The geometry is only in __dict__ if it was loaded (or set), otherwise it can't have changed
+        update_fields = kwargs.get("update_fields")
+        if "geometry" in self.__dict__ and (update_fields is None or "geometry" in update_fields):
+            self.set_shapes()
+            if update_fields is not None:
+                kwargs["update_fields"] = set(update_fields) | {"centroid", "bbox", "area"}
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         if hasattr(self, "garden"):
             return f"/gardens/{self.id}/"
@@ -571,28 +795,37 @@ class ReferenceSpace(models.Model):
     @property
     def get_lat(self):
         try:
-            return self.geometry.centroid[1]
+            return (self.centroid or self.geometry.centroid)[1]
         except:
             return None
 
+    # Photos belong to gardens, so other spaces never have one. Querysets that show the photo
+    # of many spaces should use with_primary_photo(), which loads all of them in one query.
     @property
     def photo(self):
-        if self.photos.all():
-            return self.photos.all()[0]
+        if isinstance(self, Garden):
+            garden = self
         else:
-            return None
+            try:
+                garden = self.garden
+            except Garden.DoesNotExist:
+                return None
+        if "primary_photos" in garden.__dict__:
+            return garden.primary_photos[0] if garden.primary_photos else None
+        return Photo.objects.filter(garden=garden).order_by("position", "date").first()
 
     @property
     def thumbnail(self):
-        if self.photos.all():
-            return self.photos.all()[0].thumbnail
+        photo = self.photo
+        if photo:
+            return photo.thumbnail
         else:
             return settings.MEDIA_URL + "placeholder.png"
 
     @property
     def get_lng(self):
         try:
-            return self.geometry.centroid[0]
+            return (self.centroid or self.geometry.centroid)[0]
         except:
             return None
 
@@ -600,26 +833,51 @@ class ReferenceSpace(models.Model):
         v = VegetationType.objects.filter(spaces=self)
         return v[0] if v else None
 
+    # Lists should use with_suburb() so that the suburbs come from the same query
     @property
     def suburb(self):
-        if not self.geometry:
-            return None
-        suburb = ReferenceSpace.objects.filter(source_id=334434, geometry__intersects=self.geometry)
-        if suburb:
-            return suburb[0].name.title()
-        else:
-            return None
+        if "suburb_name" in self.__dict__:
+            return self.suburb_name.title() if self.suburb_name else None
+        return get_suburb(self.geometry)
     
     def get_popup(self):
         content = f"<h4>{self.name}</h4>"
-        if self.photo:
-            content = content + f"<a class='d-block' href='{self.get_absolute_url()}'><img alt='{self.name}' src='{self.photo.image.thumbnail.url}' /></a><hr>"
+        photo = self.photo
+        if photo:
+            content = content + f"<a class='d-block' href='{self.get_absolute_url()}'><img alt='{self.name}' src='{photo.thumbnail}' /></a><hr>"
         content = content + f"<a href='{self.get_absolute_url()}'>View details</a>"
         return mark_safe(content)
 
     class Meta:
         ordering = ["name"]
 
+# SRID 6933 (WGS 84 / Cylindrical Equal-Area), which keeps area measurements accurate globally
+AREA_SRID = 6933
+
+# Same as ReferenceSpace.set_shapes() but for a whole queryset at once, done by PostGIS. Use this
+# after bulk_create() or update(), which don't call save().
+def update_space_shapes(spaces):
+    spaces.update(
+        centroid=Centroid("geometry"),
+        bbox=Envelope("geometry"),
+        area=Area(Transform("geometry", AREA_SRID)),
+    )
+
+# The shapefile with all suburb boundaries
+SUBURBS = 334434
+
+def get_suburb(geometry):
+    if not geometry:
+        return None
+    suburb = ReferenceSpace.objects.filter(source_id=SUBURBS, geometry__intersects=geometry).values_list("name", flat=True).first()
+    return suburb.title() if suburb else None
+
+# Adds the name of the suburb to every space in the queryset with a correlated subquery, which
+# PostgreSQL runs as an index lookup per row (a lateral join), instead of one query per space
+def with_suburb(spaces):
+    suburbs = ReferenceSpace.objects.filter(source_id=SUBURBS, geometry__intersects=OuterRef("geometry")).order_by("id")
+    return spaces.annotate(suburb_name=Subquery(suburbs.values("name")[:1]))
+
 class Garden(ReferenceSpace):
     is_active = models.BooleanField(default=True, db_index=True)
     is_user_created = models.BooleanField(default=False, db_index=True)
@@ -681,26 +939,54 @@ class Garden(ReferenceSpace):
         else:
             return None
 
+    # We keep a copy of the geometry and site as they were loaded from the database, so that
+    # save() only needs to re-derive the vegetation type when one of them actually changed
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_location()
+        return instance
+
+    def _remember_location(self):
+        # Deferred fields are not in __dict__; those can't have been changed either
+        self._loaded_geometry = self.geometry.ewkb if self.__dict__.get("geometry") else self.__dict__.get("geometry", False)
+        self._loaded_site_id = self.__dict__.get("site_id", False)
+        self._loaded_vegetation_type_id = self.__dict__.get("vegetation_type_id", False)
+
     @property
-    def photo(self):
-        return Photo.objects.filter(garden=self).order_by("position", "date").first()
+    def location_changed(self):
+        if self._state.adding or not hasattr(self, "_loaded_geometry"):
+            return True
+        if "site_id" in self.__dict__ and self.site_id != self._loaded_site_id:
+            return True
+        if "geometry" in self.__dict__:
+            geometry = self.geometry.ewkb if self.geometry else self.geometry
+            return geometry != self._loaded_geometry
+        return False
+
+    def get_vegetation_type_for_location(self):
+        veg = None
+        if self.geometry:
+            veg = VegetationLocator.for_site(self.site).locate(self.geometry.centroid)
 
-    def save(self, *args, **kwargs):
-        vegetation = Document.objects.get(pk=983172)
-        
         # Default to the first veg type in the system
-        veg = VegetationType.objects.filter(site=self.site, is_negative=False).first()
+        if not veg:
+            veg = VegetationType.objects.filter(site=self.site, is_negative=False).first()
 
-        if self.geometry:
-            try:
-                veg = vegetation.spaces.get(geometry__intersects=self.geometry.centroid)
-                veg = veg.get_vegetation_type()
-            except:
-                veg = VegetationType.objects.filter(site=self.site, is_negative=False).first()
+        return veg
 
-        self.vegetation_type = veg
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        self._location_changed = self.location_changed and (update_fields is None or bool({"geometry", "site", "site_id"} & set(update_fields)))
+
+        if self._location_changed or not self.vegetation_type_id:
+            self.vegetation_type = self.get_vegetation_type_for_location()
+            if update_fields is not None:
+                kwargs["update_fields"] = set(update_fields) | {"vegetation_type"}
+        self._vegetation_type_changed = self._state.adding or self.vegetation_type_id != getattr(self, "_loaded_vegetation_type_id", None)
 
         super().save(*args, **kwargs)
+        self._remember_location()
 
 
     def process_location_file(self):
@@ -749,6 +1035,78 @@ class Garden(ReferenceSpace):
 
             return False, _("We were unable to save the coordinates, please make sure it is a valid KMZ file. Error: ") + str(e)
 
+class SimplifyPreserveTopology(GeomOutputGeoFunc):
+    pass
+
+# To avoid sending every polygon at full resolution to the browser, we keep simplified
+# versions of the geometry of each space. Maps pick the level that fits their zoom level.
+class SimplifiedGeometry(models.Model):
+
+    class Level(models.IntegerChoices):
+        LOW = 1, _("Low detail")
+        MEDIUM = 2, _("Medium detail")
+        HIGH = 3, _("High detail")
+
+    # Tolerance in degrees (1/1000 degree is roughly 100m)
+    TOLERANCE = {
+        Level.LOW: 0.001,
+        Level.MEDIUM: 0.0002,
+        Level.HIGH: 0.00004,
+    }
+
+    # The highest zoom level at which each level is still good enough
+    MAX_ZOOM = {
+        Level.LOW: 10,
+        Level.MEDIUM: 13,
+        Level.HIGH: 15,
+    }
+
+    space = models.ForeignKey(ReferenceSpace, on_delete=models.CASCADE, related_name="simplified_geometries")
+    level = models.PositiveSmallIntegerField(choices=Level.choices)
+    geometry = models.GeometryField()
+
+    def __str__(self):
+        return f"{self.space} ({self.get_level_display()})"
+
+    class Meta:
+        unique_together = ["space", "level"]
+
+# Returns the level to use for a given zoom level, or None if we need the full geometry
+def get_simplification_level(zoom):
+    if zoom is None:
+        return None
+    for level, max_zoom in SimplifiedGeometry.MAX_ZOOM.items():
+        if zoom <= max_zoom:
+            return level
+    return None
+
+# Adds the geometry at the given level as map_geometry to the spaces queryset. If a space has no
+# simplified geometry (yet), the full geometry is used.
+def with_simplified_geometry(spaces, level):
+    if not level:
+        return spaces.annotate(map_geometry=F("geometry"))
+    simplified = SimplifiedGeometry.objects.filter(space=OuterRef("pk"), level=level).values("geometry")[:1]
+    return spaces.annotate(map_geometry=Coalesce(Subquery(simplified), "geometry", output_field=models.GeometryField()))
+
+# Gardens send their own signals (not those of ReferenceSpace), so we listen to both
+@receiver([post_save, post_delete], sender=ReferenceSpace)
+@receiver([post_save, post_delete], sender=Garden)
+def reference_space_changed(sender, instance, raw=False, **kwargs):
+    if not raw and instance.source_id:
+        bump_spaces_version_on_commit(instance.source_id)
+
+# Gardens are drawn and saved one by one, so we simplify them right away
+@receiver(post_save, sender=Garden)
+def simplify_garden_geometry(sender, instance, raw=False, **kwargs):
+    if raw or not getattr(instance, "_location_changed", True):
+        return
+    SimplifiedGeometry.objects.filter(space=instance).delete()
+    if instance.geometry:
+        SimplifiedGeometry.objects.bulk_create([
+            SimplifiedGeometry(space=instance, level=level, geometry=instance.geometry.simplify(tolerance, preserve_topology=True))
+            for level, tolerance in SimplifiedGeometry.TOLERANCE.items()
+        ])
+
 class Event(models.Model):
     name = models.CharField(max_length=255, db_index=True)
     content = models.TextField(null=True, blank=True)
@@ -829,6 +1187,93 @@ class VegetationType(models.Model):
     class Meta:
         ordering = ["is_negative", "name"]
 
+# The default vegetation map, for sites that don't have one set
+VEGETATION_MAP = 983172
+
+# Finds the vegetation type at a given point without going to the database. The polygons of a
+# vegetation map are loaded once per process as prepared geometries, together with their bounding
+# boxes in numpy arrays: a lookup first narrows down the candidates by bounding box and then only
+# checks those few polygons. Locators are dropped whenever the spaces of the map change (see
+# bump_spaces_version) or the vegetation types change, and re-check the versions of the map (both
+# spaces_version and vegetation_types_version) every LOCATOR_CHECK_INTERVAL seconds so that other
+# processes pick up changes as well.
+LOCATOR_CHECK_INTERVAL = 60
+
+class VegetationLocator:
+    locators = {}
+
+    def __init__(self, document_id):
+        self.document_id = document_id
+        self.version = self.get_version(document_id)
+        self.checked_at = time.monotonic()
+
+        links = {}
+        for space_id, vegetation_type_id in VegetationType.spaces.through.objects.filter(referencespace__source_id=document_id).values_list("referencespace_id", "vegetationtype_id"):
+            links.setdefault(space_id, vegetation_type_id)
+        types = VegetationType.objects.in_bulk(set(links.values()))
+
+        self.geometries = []
+        self.vegetation_types = []
+        extents = []
+        for id, geometry in ReferenceSpace.objects.filter(source_id=document_id, geometry__isnull=False).order_by("id").values_list("id", "geometry"):
+            self.geometries.append(geometry.prepared)
+            self.vegetation_types.append(types.get(links.get(id)))
+            extents.append(geometry.extent)
+        extents = np.array(extents, dtype=float).reshape(-1, 4)
+        self.xmin, self.ymin, self.xmax, self.ymax = extents.T
+
+    @staticmethod
+    def get_version(document_id):
+        return Document.objects.filter(pk=document_id).values_list("spaces_version", "vegetation_types_version").first()
+
+    @classmethod
+    def for_document(cls, document_id):
+        locator = cls.locators.get(document_id)
+        if locator and time.monotonic() - locator.checked_at > LOCATOR_CHECK_INTERVAL:
+            version = cls.get_version(document_id)
+            if version == locator.version:
+                locator.checked_at = time.monotonic()
+            else:
+                locator = None
+        if not locator:
+            locator = cls.locators[document_id] = cls(document_id)
+        return locator
+
+    @classmethod
+    def for_site(cls, site):
+        return cls.for_document(site.vegetation_types_map_id if site and site.vegetation_types_map_id else VEGETATION_MAP)
+
+    @classmethod
+    def invalidate(cls, document_id=None):
+        if document_id:
+            cls.locators.pop(document_id, None)
+        else:
+            cls.locators.clear()
+
+    # Returns the vegetation type of the first polygon that contains the point (a copy, so that
+    # callers can't change the cached instance), or None if the point is outside the map
+    def locate(self, point):
+        x, y = point.x, point.y
+        candidates = np.flatnonzero((self.xmin <= x) & (self.xmax >= x) & (self.ymin <= y) & (self.ymax >= y))
+        for i in candidates:
+            if self.geometries[i].intersects(point):
+                vegetation_type = self.vegetation_types[i]
+                return copy.copy(vegetation_type) if vegetation_type else None
+        return None
+
+@receiver(post_save, sender=VegetationType)
+@receiver(post_delete, sender=VegetationType)
+@receiver(m2m_changed, sender=VegetationType.spaces.through)
+def invalidate_vegetation_locators(sender, **kwargs):
+    if kwargs.get("action", "post_").startswith("pre_"):
+        return
+    # Locators in other processes only notice changes through the versions of their map (see
+    # for_document), so we bump those of every vegetation map rather than only clearing ours
+    document_ids = set(Site.objects.exclude(vegetation_types_map__isnull=True).values_list("vegetation_types_map_id", flat=True))
+    document_ids.add(VEGETATION_MAP)
+    Document.objects.filter(pk__in=document_ids).update(vegetation_types_version=models.F("vegetation_types_version")+1)
+    VegetationLocator.invalidate()
+
 class SpeciesFeatures(models.Model):
     name = models.CharField(max_length=255, db_index=True)
 
@@ -934,6 +1379,10 @@ class Species(models.Model):
     class Meta:
         ordering = ["name"]
         verbose_name_plural = "Species"
+        indexes = [
+            # Trigram index for the autocomplete (icontains is UPPER(name) LIKE UPPER('%...%'))
+            GinIndex(OpClass(Upper("name"), name="gin_trgm_ops"), name="species_name_trgm"),
+        ]
 
     def get_absolute_url(self):
         return reverse("species", args=[self.id])
@@ -972,10 +1421,13 @@ class Species(models.Model):
                     links[link] = link
         return links
 
+    # Lists should use with_common_name(), which loads the names of all species in the same query
     @property
     def name_en(self):
+        if "common_name" in self.__dict__:
+            return self.common_name
         try:
-            return self.texts.get(language_id=1).common_name
+            return self.texts.get(language_id=ENGLISH).common_name
         except:
             return None
 
@@ -1178,6 +1630,23 @@ class SpeciesText(models.Model):
     propagation_seed = models.TextField(null=True, blank=True)
     propagation_cutting = models.TextField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            GinIndex(OpClass(Upper("common_name"), name="gin_trgm_ops"), name="speciestext_common_name_trgm"),
+        ]
+
+# The id of the English language, which is what we fall back to if there is no text in the active language
+ENGLISH = 1
+
+# Annotates species with their common name in the given language (a Language code, e.g. request.language),
+# falling back to the English name, so that name_en doesn't need a query for every species in a list
+def with_common_name(species, language=None):
+    texts = SpeciesText.objects.filter(species=OuterRef("pk")).order_by("id")
+    name = Subquery(texts.filter(language_id=ENGLISH).values("common_name")[:1])
+    if language:
+        name = Coalesce(Subquery(texts.filter(language__code=language).values("common_name")[:1]), name)
+    return species.annotate(common_name=name)
+
 class SpeciesVegetationTypeLink(models.Model):
     species = models.ForeignKey(Species, on_delete=models.CASCADE, related_name="species_links")
     vegetation_type = models.ForeignKey(VegetationType, on_delete=models.CASCADE)
@@ -1187,6 +1656,11 @@ class SpeciesSynonym(models.Model):
     name = models.CharField(max_length=255, unique=True)
     species = models.ForeignKey(Species, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            GinIndex(OpClass(Upper("name"), name="gin_trgm_ops"), name="speciessynonym_name_trgm"),
+        ]
+
 class Photo(models.Model):
     description = models.TextField(null=True, blank=True)
     image = StdImageField(upload_to="photos", variations={"thumbnail": (350, 350), "medium": (800, 600), "large": (1280, 1024)}, delete_orphans=True, null=True, blank=True)
@@ -1264,6 +1738,34 @@ class Photo(models.Model):
     class Meta:
         ordering = ["position", "date"]
 
+# Attaches the first photo (by position and date) of each garden to a queryset of gardens or spaces,
+# as a primary_photos list of at most one photo. A window function picks that photo inside the
+# prefetch query, so we only load one photo per garden in one query in total.
+def with_primary_photo(spaces):
+    photos = Photo.objects.annotate(
+        rank=Window(RowNumber(), partition_by=F("garden_id"), order_by=[F("position").asc(), F("date").asc()])
+    ).filter(rank=1)
+    lookup = "photos" if spaces.model is Garden else "garden__photos"
+    if spaces.model is not Garden:
+        spaces = spaces.select_related("garden")
+    return spaces.prefetch_related(Prefetch(lookup, queryset=photos, to_attr="primary_photos"))
+
+# The marker data of the gardens map (see gardens_json) is cached per site, under a key with a
+# version that is bumped whenever a garden or one of its photos changes (see CacheVersion)
+def get_gardens_cache_key(site_id):
+    return f"gardens_json_{site_id}_{CacheVersion.get(f'gardens_{site_id}')}"
+
+@receiver([post_save, post_delete], sender=Garden)
+def garden_map_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        CacheVersion.bump(f"gardens_{instance.site_id}")
+
+@receiver([post_save, post_delete], sender=Photo)
+def garden_photo_changed(sender, instance, raw=False, **kwargs):
+    if instance.garden_id and not raw:
+        site_id = Garden.objects_unfiltered.filter(pk=instance.garden_id).values_list("site_id", flat=True).first()
+        CacheVersion.bump(f"gardens_{site_id}")
+
 class Corridor(models.Model):
     name = models.CharField(max_length=255)
     general_description = models.TextField(null=True, blank=True)
@@ -1306,6 +1808,20 @@ class GardenSpecies(models.Model):
     class Meta:
         unique_together = ["garden", "species"]
 
+    # Adds the species to the garden with a single INSERT ... ON CONFLICT DO NOTHING, so species that
+    # are already in the garden (with any status) are left alone. Returns the number of species that
+    # were added and the number that were already there.
+    @classmethod
+    def bulk_add(cls, garden, species_ids, status):
+        species_ids = set(species_ids)
+        existing = cls.objects.filter(garden=garden, species_id__in=species_ids).count()
+        cls.objects.bulk_create([cls(garden=garden, species_id=id, status=status) for id in species_ids], ignore_conflicts=True)
+        added = len(species_ids) - existing
+        # bulk_create() doesn't send post_save, so we do what garden_species_changed would do
+        if added:
+            mark_garden_scores_stale(garden=garden)
+        return added, existing
+
 class GardenManager(models.Model):
     name = models.CharField(max_length=255)
     email = models.CharField(max_length=255)
@@ -1392,6 +1908,103 @@ class DiversityCriteria(models.Model):
         ]
         ordering = ["vegetation_type", "feature__species_type", "feature__name"]
 
+# Stored score per garden and status, so that we don't need to recalculate the score on every
+# page view. The snapshot is marked as stale by the signals below whenever anything that feeds
+# into the score changes, and recalculated the next time it is requested (see scoring.py).
+class GardenScore(models.Model):
+    garden = models.ForeignKey(Garden, on_delete=models.CASCADE, related_name="score_snapshots")
+    status = models.CharField(choices=GardenSpecies.STATUS_OPTIONS, db_index=True, max_length=10)
+    scores = models.JSONField(null=True, blank=True)
+    is_stale = models.BooleanField(default=False, db_index=True)
+    version = models.PositiveIntegerField(default=0) # Increased every time the snapshot is marked as stale
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.get_status_display()} score for {self.garden}"
+
+    class Meta:
+        unique_together = ["garden", "status"]
+
+def mark_garden_scores_stale(**filters):
+    GardenScore.objects.filter(**filters).update(is_stale=True, version=F("version")+1)
+
+@receiver([post_save, post_delete], sender=GardenSpecies)
+def garden_species_changed(sender, instance, **kwargs):
+    mark_garden_scores_stale(garden_id=instance.garden_id)
+
+@receiver(post_save, sender=Garden)
+def garden_changed(sender, instance, **kwargs):
+    # The score only depends on the garden itself through its vegetation type
+    if getattr(instance, "_vegetation_type_changed", True):
+        mark_garden_scores_stale(garden=instance)
+
+@receiver(m2m_changed, sender=Garden.targets.through)
+def garden_targets_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # For clear() we need to act before the links are gone, otherwise we can't find the gardens
+    if action not in ["post_add", "post_remove", "pre_clear"]:
+        return
+    if not reverse:
+        mark_garden_scores_stale(garden=instance)
+    elif pk_set:
+        mark_garden_scores_stale(garden_id__in=pk_set)
+    else:
+        mark_garden_scores_stale(garden__targets=instance)
+
+@receiver(post_save, sender=Page)
+def target_page_changed(sender, instance, **kwargs):
+    # The minimum species/flowering numbers for the score are stored in the meta_data of target pages
+    if instance.page_type == Page.PageType.TARGET:
+        mark_garden_scores_stale(garden__targets=instance)
+
+@receiver([post_save, post_delete], sender=DiversityCriteria)
+def diversity_criteria_changed(sender, instance, **kwargs):
+    mark_garden_scores_stale(garden__vegetation_type_id=instance.vegetation_type_id)
+
+@receiver(post_save, sender=VegetationType)
+def vegetation_type_changed(sender, instance, **kwargs):
+    mark_garden_scores_stale(garden__vegetation_type=instance)
+
+@receiver([post_save, post_delete], sender=FeatureSiteScore)
+def feature_site_score_changed(sender, instance, **kwargs):
+    mark_garden_scores_stale(garden__site_id=instance.site_id)
+
+@receiver(post_save, sender=Species)
+def species_changed(sender, instance, **kwargs):
+    # Flowering months are stored on the species itself
+    mark_garden_scores_stale(garden__plants__species=instance)
+
+@receiver(m2m_changed, sender=Species.features.through)
+@receiver(m2m_changed, sender=Species.vegetation_types.through)
+def species_links_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ["post_add", "post_remove", "pre_clear"]:
+        return
+    if not reverse:
+        mark_garden_scores_stale(garden__plants__species=instance)
+    elif pk_set:
+        mark_garden_scores_stale(garden__plants__species_id__in=pk_set)
+
+# The species x feature matrices used to rank suggestions (see scoring.get_suggestion_matrix) are
+# held in memory by each process. They are rebuilt when this version, which is kept in the database
+# (see CacheVersion) so that all processes see it, changes.
+SUGGESTION_MATRIX_VERSION_KEY = "suggestion_matrix"
+
+def get_suggestion_matrix_version():
+    return CacheVersion.get(SUGGESTION_MATRIX_VERSION_KEY)
+
+def bump_suggestion_matrix_version():
+    CacheVersion.bump(SUGGESTION_MATRIX_VERSION_KEY)
+
+@receiver([post_save, post_delete], sender=FeatureSiteScore)
+@receiver(post_delete, sender=Species)
+def suggestion_scores_changed(sender, **kwargs):
+    bump_suggestion_matrix_version()
+
+@receiver(m2m_changed, sender=Species.features.through)
+@receiver(m2m_changed, sender=Species.site.through)
+def suggestion_links_changed(sender, action, **kwargs):
+    if action in ["post_add", "post_remove", "post_clear"]:
+        bump_suggestion_matrix_version()
+
 class GardeningActivity(models.Model):
     name = models.CharField(max_length=255)
     site = models.ForeignKey(Site, on_delete=models.CASCADE, related_name="activities")
@@ -1435,6 +2048,257 @@ class NurseryInventory(models.Model):
     def __str__(self):
         return str(self.species)
 
+# Denormalized search table for the species lists: one row per species with the ids of everything we
+# can filter on stored as integer arrays (with GIN indexes), so that any combination of filters is
+# a handful of array conditions on a single table instead of one join per filter. Kept up to date by
+# the signals below and rebuilt in full with the rebuild_species_search_index command.
+class SpeciesSearchIndex(models.Model):
+    species = models.OneToOneField(Species, on_delete=models.CASCADE, primary_key=True, related_name="search_index")
+    site_ids = ArrayField(models.IntegerField(), default=list)
+    feature_ids = ArrayField(models.IntegerField(), default=list)
+    color_ids = ArrayField(models.IntegerField(), default=list)
+    vegetation_type_ids = ArrayField(models.IntegerField(), default=list)
+    nursery_ids = ArrayField(models.IntegerField(), default=list)
+    in_stock_nursery_ids = ArrayField(models.IntegerField(), default=list)
+    source_ids = ArrayField(models.IntegerField(), default=list) # Documents with a species list that includes this species
+
+    def __str__(self):
+        return str(self.species_id)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["site_ids"], name="species_search_sites"),
+            GinIndex(fields=["feature_ids"], name="species_search_features"),
+            GinIndex(fields=["color_ids"], name="species_search_colors"),
+            GinIndex(fields=["vegetation_type_ids"], name="species_search_vegtypes"),
+            GinIndex(fields=["nursery_ids"], name="species_search_nurseries"),
+            GinIndex(fields=["in_stock_nursery_ids"], name="species_search_in_stock"),
+            GinIndex(fields=["source_ids"], name="species_search_sources"),
+        ]
+
+# (Re)builds the search rows of the given species, or of all species if no ids are given
+def refresh_species_search_index(species_ids=None):
+    species = Species.objects.all()
+    if species_ids is not None:
+        species = species.filter(pk__in=species_ids)
+
+    def ids(model, field, **filters):
+        return ArraySubquery(model.objects.filter(species_id=OuterRef("pk"), **filters).values(field).distinct())
+
+    rows = species.annotate(
+        index_site_ids=ids(Species.site.through, "site_id"),
+        index_feature_ids=ids(Species.features.through, "speciesfeatures_id"),
+        index_color_ids=ids(Species.colors.through, "color_id"),
+        index_vegetation_type_ids=ids(Species.vegetation_types.through, "vegetationtype_id"),
+        index_nursery_ids=ids(NurseryInventory, "nursery_id"),
+        index_in_stock_nursery_ids=ids(NurseryInventory, "nursery_id", in_stock=True),
+        index_source_ids=ids(FileLog, "file__attached_to"),
+    ).values_list(
+        "id", "index_site_ids", "index_feature_ids", "index_color_ids", "index_vegetation_type_ids",
+        "index_nursery_ids", "index_in_stock_nursery_ids", "index_source_ids",
+    )
+
+    fields = ["site_ids", "feature_ids", "color_ids", "vegetation_type_ids", "nursery_ids", "in_stock_nursery_ids", "source_ids"]
+    objects = [SpeciesSearchIndex(species_id=id, **dict(zip(fields, arrays))) for id, *arrays in rows]
+    SpeciesSearchIndex.objects.bulk_create(objects, batch_size=1000, update_conflicts=True, unique_fields=["species"], update_fields=fields)
+    return len(objects)
+
+@receiver(post_save, sender=Species)
+def species_search_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_species_search_index([instance.id])
+
+# Inside this block, changes to nursery inventories don't refresh the search index row by row. The
+# species involved are refreshed together when the block ends. Use it when editing many rows at once.
+_search_index_batch = threading.local()
+
+@contextmanager
+def species_search_index_batch():
+    _search_index_batch.species_ids = set()
+    try:
+        yield
+    finally:
+        species_ids = _search_index_batch.species_ids
+        _search_index_batch.species_ids = None
+        if species_ids:
+            refresh_species_search_index(species_ids)
+
+# File logs are only written in bulk by the species list import, which refreshes the index itself.
+# Their deletes are handled through the attachment they belong to (see below).
+@receiver([post_save, post_delete], sender=NurseryInventory)
+def species_search_related_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    batch = getattr(_search_index_batch, "species_ids", None)
+    if batch is not None:
+        batch.add(instance.species_id)
+    else:
+        refresh_species_search_index([instance.species_id])
+
+@receiver(m2m_changed, sender=Species.site.through)
+@receiver(m2m_changed, sender=Species.features.through)
+@receiver(m2m_changed, sender=Species.colors.through)
+@receiver(m2m_changed, sender=Species.vegetation_types.through)
+def species_search_links_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ["post_add", "post_remove", "post_clear"]:
+            refresh_species_search_index([instance.id])
+        return
+
+    # When clearing from the other side (e.g. feature.species.clear()) we need to find the species
+    # before the links are gone
+    if action == "pre_clear":
+        field = [f.name for f in sender._meta.concrete_fields if f.is_relation and f.related_model is not Species][0]
+        instance._search_index_species = list(sender.objects.filter(**{field: instance}).values_list("species_id", flat=True))
+    elif action == "post_clear":
+        refresh_species_search_index(getattr(instance, "_search_index_species", []))
+    elif action in ["post_add", "post_remove"] and pk_set:
+        refresh_species_search_index(pk_set)
+
+# The file logs of a species list go when its attachment (or the whole document) is deleted, so we
+# note which species they belonged to beforehand and take their source out of the index afterwards
+@receiver(pre_delete, sender=Attachment)
+def species_search_attachment_deleting(sender, instance, **kwargs):
+    instance._search_index_species = list(FileLog.objects.filter(file=instance).values_list("species_id", flat=True).distinct())
+
+@receiver(post_delete, sender=Attachment)
+def species_search_attachment_deleted(sender, instance, **kwargs):
+    if getattr(instance, "_search_index_species", None):
+        refresh_species_search_index(instance._search_index_species)
+
+# Precomputed analysis layer for the 1km site analysis report. The report boundary is divided
+# into a grid of square cells and for each cell we store how many meters of river/railway run
+# through it. A report then simply adds up the cells that fall within the circle. Built with the
+# build_analysis_grid management command. Feature counts are not part of the grid: the report
+# counts everything that intersects the circle, which a grid of cells can't reproduce.
+# Every cell stores the spaces_version of the line layers it was built from. The report only uses
+# cells that match the current versions, and a change to either layer queues a rebuild as a Job.
+ANALYSIS_BOUNDARY = 988911
+ANALYSIS_LENGTH_LAYERS = {
+    "river_length": 983382,
+    "railway_length": 2,
+}
+
+def get_analysis_layer_versions():
+    versions = dict(Document.objects.filter(pk__in=ANALYSIS_LENGTH_LAYERS.values()).values_list("id", "spaces_version"))
+    return {field: versions.get(source) for field, source in ANALYSIS_LENGTH_LAYERS.items()}
+
+# One pending build is enough: it reads the layers when it starts, so it includes every change before that
+def queue_analysis_grid_build():
+    if not Job.objects.filter(job_type=Job.JobType.BUILD_ANALYSIS_GRID, status=Job.Status.PENDING).exists():
+        Job.objects.create(job_type=Job.JobType.BUILD_ANALYSIS_GRID)
+
+class AnalysisCell(models.Model):
+    row = models.PositiveIntegerField()
+    col = models.PositiveIntegerField()
+    size = models.PositiveIntegerField(help_text="Width/height of the cell in meters (web mercator)")
+    geometry = models.PolygonField()
+    center = models.PointField()
+    river_length = models.FloatField(default=0)
+    railway_length = models.FloatField(default=0)
+    layer_versions = models.JSONField(default=dict, help_text="The spaces_version of each line layer at the time the grid was built")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Analysis cell {self.row}/{self.col}"
+
+    class Meta:
+        unique_together = ["row", "col"]
+
+# A simple database-backed job queue for slow tasks (importing shapefiles, creating plots, clipping)
+# so that these don't run inside a web request. Jobs are picked up by the run_jobs management command.
+class Job(models.Model):
+
+    class JobType(models.TextChoices):
+        CONVERT_SHAPEFILE = "convert_shapefile", _("Import shapefile")
+        SHAPEFILE_PLOT = "shapefile_plot", _("Create shapefile plot")
+        CLIP_SPACES = "clip_spaces", _("Clip spaces")
+        BUILD_ANALYSIS_GRID = "build_analysis_grid", _("Build analysis grid")
+
+    class Status(models.IntegerChoices):
+        PENDING = 1, _("Pending")
+        RUNNING = 2, _("Running")
+        COMPLETED = 3, _("Completed")
+        FAILED = 4, _("Failed")
+
+    job_type = models.CharField(choices=JobType.choices, max_length=50, db_index=True)
+    status = models.IntegerField(choices=Status.choices, db_index=True, default=Status.PENDING)
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, null=True, blank=True, related_name="jobs")
+    params = models.JSONField(null=True, blank=True)
+    progress = models.PositiveSmallIntegerField(default=0, help_text="Percentage")
+    message = models.TextField(null=True, blank=True, help_text="The result, or the error if the job failed")
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name="jobs")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.get_job_type_display()} ({self.get_status_display()})"
+
+    class Meta:
+        ordering = ["created_at"]
+
+    @property
+    def is_active(self):
+        return self.status in [self.Status.PENDING, self.Status.RUNNING]
+
+    # A job that is still running after this long is assumed to belong to a worker that crashed
+    # or was stopped, and is picked up again by the next claim()
+    TIMEOUT = datetime.timedelta(hours=6)
+
+    # Takes the oldest pending (or abandoned) job and marks it as running. With skip_locked, several
+    # workers can run at the same time without picking up the same job.
+    @classmethod
+    def claim(cls):
+        abandoned = Q(status=cls.Status.RUNNING, started_at__lt=timezone.now()-cls.TIMEOUT)
+        with transaction.atomic():
+            job = cls.objects.select_for_update(skip_locked=True).filter(Q(status=cls.Status.PENDING)|abandoned).order_by("created_at").first()
+            if job:
+                job.status = cls.Status.RUNNING
+                job.started_at = timezone.now()
+                job.progress = 0
+                job.save(update_fields=["status", "started_at", "progress"])
+        return job
+
+    # Shapefiles are imported in a single transaction, so the progress is written through a database
+    # connection of its own. Otherwise the control panel would not see it until the job is done.
+    def set_progress(self, processed, total):
+        self.progress = int(processed/total*100) if total else 100
+        if not getattr(self, "_progress_connection", None):
+            self._progress_connection = connections.create_connection(DEFAULT_DB_ALIAS)
+        with self._progress_connection.cursor() as cursor:
+            cursor.execute(f"UPDATE {Job._meta.db_table} SET progress = %s WHERE id = %s", [self.progress, self.pk])
+
+    def run(self):
+        try:
+            document = self.document
+            if self.job_type == self.JobType.CONVERT_SHAPEFILE:
+                document.convert_shapefile(progress=self.set_progress)
+                if document.meta_data.get("processing_error"):
+                    raise Exception(document.meta_data["processing_error"])
+                self.message = f"{document.spaces.count()} spaces were imported."
+            elif self.job_type == self.JobType.SHAPEFILE_PLOT:
+                if not document.create_shapefile_plot():
+                    raise Exception(document.meta_data.get("shapefile_plot_error"))
+                self.message = "Plot image was created."
+            elif self.job_type == self.JobType.CLIP_SPACES:
+                clip_boundaries = ReferenceSpace.objects.get(pk=self.params["clip"])
+                total_to_delete, total_to_clip = document.clip_spaces(clip_boundaries, progress=self.set_progress)
+                self.message = f"Borders were clipped to {clip_boundaries.name}; {total_to_delete} spaces were removed and {total_to_clip} spaces were clipped."
+            elif self.job_type == self.JobType.BUILD_ANALYSIS_GRID:
+                call_command("build_analysis_grid")
+                self.message = f"{AnalysisCell.objects.count()} analysis cells were built."
+            self.status = self.Status.COMPLETED
+            self.progress = 100
+        except Exception as e:
+            self.status = self.Status.FAILED
+            self.message = str(e)
+        if getattr(self, "_progress_connection", None):
+            self._progress_connection.close()
+            self._progress_connection = None
+        self.finished_at = timezone.now()
+        self.save()
+
 # E-mail quota management
 class EmailQuota(models.Model):
     count = models.PositiveIntegerField(default=0)
@@ -0,0 +1,201 @@
+from .models import Species, DiversityCriteria, GardenScore, FeatureSiteScore, get_suggestion_matrix_version
+
+from collections import Counter
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db.models import Exists, OuterRef, Q, Value, BooleanField, Sum
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+import numpy as np
+
+MONTHS = np.arange(1, 13, dtype=np.uint16)
+
+# Loads everything we need to score a garden in a single query: one row per species
+# with its flowering months, its feature ids and whether it is locally indigenous
+# for the given vegetation type. Flowering months are packed into a bitmask (bit 1 = Jan)
+# so that all the per-month counts can be done in one go with numpy.
+def load_garden_species(garden, status, veg_type=None):
+
+    if veg_type is None:
+        veg_type = garden.vegetation_type
+
+    # For current gardens, only check PRESENT species. For future gardens, we want all plants (present+future)
+    # Note that both conditions must go into the same filter() call so they apply to the same garden_plants row
+    if status == "PRESENT":
+        species = Species.objects.filter(garden_plants__garden=garden, garden_plants__status=status)
+    else:
+        species = Species.objects.filter(garden_plants__garden=garden)
+
+    if veg_type:
+        is_local = Exists(Species.vegetation_types.through.objects.filter(species_id=OuterRef("pk"), vegetationtype_id=veg_type.id))
+    else:
+        is_local = Value(False, output_field=BooleanField())
+
+    rows = species.annotate(
+        feature_ids=ArrayAgg("features__id", distinct=True, filter=Q(features__isnull=False)),
+        is_local=is_local,
+    ).values_list("id", "flowering", "feature_ids", "is_local")
+
+    ids = []
+    masks = []
+    feature_counts = Counter()
+    locally_indigenous = 0
+    for id, flowering, feature_ids, local in rows:
+        ids.append(id)
+        masks.append(sum(1 << month for month in set(flowering or [])))
+        feature_counts.update(feature_ids or [])
+        if local:
+            locally_indigenous += 1
+
+    flowering = np.array(masks, dtype=np.uint16)
+    if len(flowering):
+        month_counts = ((flowering[:, None] >> MONTHS) & 1).sum(axis=0)
+    else:
+        month_counts = np.zeros(12, dtype=np.int64)
+
+    return {
+        "species_ids": ids,
+        "vegetation_type": veg_type,
+        "flowering": flowering,
+        "month_counts": month_counts, # Number of species flowering in each month, index 0 = January
+        "feature_counts": feature_counts, # Number of species with each feature id
+        "locally_indigenous": locally_indigenous,
+    }
+
+# Returns the months (1-12) in which fewer than `minimum` species are flowering
+def get_flowering_failures(data, minimum):
+    return [int(month) for month in MONTHS[data["month_counts"] < minimum]]
+
+# The fixed parts of the score are keyed by these language-neutral ids (the targets by the name of
+# their page), so that stored snapshots are the same for every visitor. The ids double as the anchors
+# of the sections on the scorecard; the labels are translated when shown (see the score_label filter).
+SCORE_LABELS = {
+    "species-composition": _("Species composition"),
+    "species-diversity": _("Species diversity"),
+}
+
+# We calculate the various scores for a garden here. Pass in the output of load_garden_species()
+# if it was already loaded for the same garden/status, otherwise it will be loaded here.
+def get_garden_score(garden, status, data=None):
+
+    if data is None:
+        data = load_garden_species(garden, status)
+
+    if not data["species_ids"]:
+        return None
+
+    veg_type = data["vegetation_type"]
+    feature_counts = data["feature_counts"]
+    scores = {}
+    total = 0
+
+    # For species composition we check how many locally indigenous species are present,
+    # and reduce points for invasives
+    score = min(data["locally_indigenous"], veg_type.minimum_species)*veg_type.score_per_species
+    scores["species-composition"] = int(score)
+    total += score
+
+    # For species diversity we check how many of the criteria are met
+    criteria = DiversityCriteria.objects.filter(vegetation_type=veg_type).values_list("feature_id", "quantity")
+    criteria_met = sum(1 for feature_id, quantity in criteria if feature_counts[feature_id] >= quantity)
+    score = int((criteria_met/len(criteria))*100) if criteria else 0
+    scores["species-diversity"] = score
+    total += score
+
+    for each in garden.targets.prefetch_related("features"):
+        score = 0
+
+        # Let's see if there are enough plants for this animal species
+        if each.meta_data.get("score_minimum_species"):
+            # A species is counted once for every target feature it has
+            number_of_species = sum(feature_counts[feature.id] for feature in each.features.all())
+            score = number_of_species/int(each.meta_data.get("score_minimum_species"))*100
+            if score > 100:
+                score = 100
+            if each.meta_data.get("score_minimum_flowering"):
+                score = score/2 # Weight is only 50% if we have a second parameter
+
+        # Let's see if there are enough flowering plants
+        if each.meta_data.get("score_minimum_flowering"):
+            score_minimum_flowering = int(each.meta_data.get("score_minimum_flowering"))
+            success_count = 12 - len(get_flowering_failures(data, score_minimum_flowering))
+            score += ((success_count/12)*100) / 2 # Weight is 50%
+
+        scores[each.name] = int(score)
+        total += score
+
+    scores["total"] = int(total)
+
+    return scores
+
+# Calculates the score and stores it as the current snapshot for this garden/status. The version
+# is read before calculating: if mark_garden_scores_stale() ran in the meantime, the new scores are
+# stored but the snapshot stays stale, so that the next visitor recalculates it again.
+def refresh_garden_score(garden, status, data=None):
+    snapshot, created = GardenScore.objects.get_or_create(garden=garden, status=status, defaults={"is_stale": True})
+    scores = get_garden_score(garden, status, data)
+    snapshots = GardenScore.objects.filter(pk=snapshot.pk)
+    if not snapshots.filter(version=snapshot.version).update(scores=scores, is_stale=False, updated_at=timezone.now()):
+        snapshots.update(scores=scores, updated_at=timezone.now())
+    return scores
+
+# Returns the stored score if it is still fresh, and recalculates it otherwise
+def get_stored_garden_score(garden, status):
+    snapshot = GardenScore.objects.filter(garden=garden, status=status, is_stale=False).first()
+    if snapshot:
+        return snapshot.scores
+    return refresh_garden_score(garden, status)
+
+# Per site: the ids of all species and of all features they have, a 0/1 matrix of which species has
+# which feature, and the points that the site gives to each feature. Kept in memory per process and
+# rebuilt when the suggestion matrix version changes.
+SUGGESTION_MATRICES = {}
+
+def get_suggestion_matrix(site):
+    version = get_suggestion_matrix_version()
+    cached = SUGGESTION_MATRICES.get(site.id)
+    if cached and cached["version"] == version:
+        return cached
+
+    species_ids = np.array(Species.objects.filter(site=site).order_by("id").values_list("id", flat=True), dtype=np.int64)
+    links = np.array(
+        Species.features.through.objects.filter(species__site=site).values_list("species_id", "speciesfeatures_id"), dtype=np.int64
+    ).reshape(-1, 2)
+    feature_ids = np.unique(links[:, 1])
+
+    matrix = np.zeros((len(species_ids), len(feature_ids)), dtype=np.uint8)
+    matrix[np.searchsorted(species_ids, links[:, 0]), np.searchsorted(feature_ids, links[:, 1])] = 1
+
+    points = np.zeros(len(feature_ids), dtype=np.int32)
+    scores = FeatureSiteScore.objects.filter(site=site, feature_id__in=feature_ids.tolist()).values("feature_id").annotate(total=Sum("points")).values_list("feature_id", "total")
+    for feature_id, total in scores:
+        points[np.searchsorted(feature_ids, feature_id)] = total
+
+    SUGGESTION_MATRICES[site.id] = cached = {
+        "version": version,
+        "species_ids": species_ids,
+        "feature_ids": feature_ids,
+        "matrix": matrix,
+        "points": points,
+    }
+    return cached
+
+# Ranks the candidate species (a list of ids, in the order used to break ties) by the total points
+# of the given features that they have. Returns the ids and points of the top `limit` species, and
+# the highest score of all candidates.
+def rank_species(site, feature_ids, candidate_ids, limit=None):
+    data = get_suggestion_matrix(site)
+    weights = np.where(np.isin(data["feature_ids"], list(feature_ids)), data["points"], 0)
+    scores = data["matrix"] @ weights
+
+    species_ids = data["species_ids"]
+    candidates = np.array(candidate_ids, dtype=np.int64)
+    if len(species_ids):
+        positions = np.searchsorted(species_ids, candidates).clip(0, len(species_ids) - 1)
+        candidate_scores = np.where(species_ids[positions] == candidates, scores[positions], 0)
+    else:
+        candidate_scores = np.zeros(len(candidates), dtype=np.int64)
+
+    order = np.argsort(-candidate_scores, kind="stable")[:limit]
+    max_points = int(candidate_scores.max()) if len(candidate_scores) else None
+    return candidates[order].tolist(), candidate_scores[order].tolist(), max_points
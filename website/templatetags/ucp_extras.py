@@ -2,6 +2,7 @@ from django import template
 from django.template.defaulttags import register
 import json
 from urllib.parse import urlparse
+from website.scoring import SCORE_LABELS
 
 register = template.Library()
 
@@ -17,6 +18,11 @@ def get_item(dictionary, key):
     except:
         return ""
 
+# Shows a key of a garden score in the current language
+@register.filter
+def score_label(key):
+    return SCORE_LABELS.get(key, key)
+
 @register.filter
 def json_dumps(string):
     if string:
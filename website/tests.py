@@ -1,3 +1,307 @@
-from django.test import TestCase
+from django.contrib.gis import geos
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, F, Q
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.text import slugify
 
-# Create your tests here.
+import math
+import os
+import shutil
+import tempfile
+
+from .models import *
+from .scoring import get_garden_score
+
+# The per-species implementation of get_garden_score() from before the scores were calculated from a
+# single bulk load (one count query per check, twelve per flowering target). It is kept here so that
+# we can check that both give the same scores. Keys use the ids of scoring.SCORE_LABELS.
+def get_garden_score_per_species(garden, status):
+    if status == "PRESENT":
+        species = Species.objects.filter(garden_plants__garden=garden, garden_plants__status=status)
+        q_filter = Q(feature__species__garden_plants__garden_id=garden.id, feature__species__garden_plants__status=status)
+    else:
+        species = Species.objects.filter(garden_plants__garden=garden)
+        q_filter = Q(feature__species__garden_plants__garden_id=garden.id)
+
+    veg_type = garden.vegetation_type
+    scores = {}
+    total = 0
+
+    if not species:
+        return None
+
+    locally_indigenous = species.filter(vegetation_types=veg_type).count()
+    score = min(locally_indigenous, veg_type.minimum_species)*veg_type.score_per_species
+    scores["species-composition"] = int(score)
+    total += score
+
+    all_criteria = DiversityCriteria.objects.filter(vegetation_type=garden.vegetation_type).count()
+    criteria_met = DiversityCriteria.objects.filter(vegetation_type=garden.vegetation_type).annotate(
+        species_count=Count("feature__species", filter=q_filter, distinct=True)
+    ).filter(species_count__gte=F("quantity")).count()
+    score = int((criteria_met/all_criteria)*100)
+    scores["species-diversity"] = score
+    total += score
+
+    for each in garden.targets.all():
+        score = 0
+        if each.meta_data.get("score_minimum_species"):
+            number_of_species = species.filter(features__in=each.features.all()).count()
+            score = number_of_species/int(each.meta_data.get("score_minimum_species"))*100
+            if score > 100:
+                score = 100
+            if each.meta_data.get("score_minimum_flowering"):
+                score = score/2
+
+        if each.meta_data.get("score_minimum_flowering"):
+            score_minimum_flowering = int(each.meta_data.get("score_minimum_flowering"))
+            success_count = 12
+            for month in range(1, 13):
+                if species.filter(flowering__contains=[month]).distinct().count() < score_minimum_flowering:
+                    success_count -= 1
+            score += ((success_count/12)*100) / 2
+
+        scores[each.name] = int(score)
+        total += score
+
+    scores["total"] = int(total)
+    return scores
+
+class GardenScoreTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        language = Language.objects.create(name="English", code="en")
+        cls.site = Site.objects.create(name="Test site", url="test.example.org", language=language)
+        vegetation_type = VegetationType.objects.create(name="Cape Flats sand fynbos", slug="cape-flats-sand-fynbos", site=cls.site, minimum_species=4)
+        other_vegetation_type = VegetationType.objects.create(name="Swartland shale renosterveld", slug="swartland-shale-renosterveld", site=cls.site, minimum_species=10)
+
+        pollinators, shade, groundcover = [SpeciesFeatures.objects.create(name=name) for name in ["Pollinators", "Shade", "Groundcover"]]
+        DiversityCriteria.objects.create(vegetation_type=vegetation_type, feature=pollinators, quantity=2)
+        DiversityCriteria.objects.create(vegetation_type=vegetation_type, feature=shade, quantity=1)
+        DiversityCriteria.objects.create(vegetation_type=vegetation_type, feature=groundcover, quantity=3)
+
+        # One target for each combination of checks
+        targets = [
+            ("Butterflies", {"score_minimum_species": 3, "score_minimum_flowering": 2}, [pollinators, groundcover]),
+            ("Sunbirds", {"score_minimum_flowering": 1}, [pollinators]),
+            ("Shade garden", {"score_minimum_species": 2}, [shade]),
+        ]
+        pages = []
+        for position, (name, meta_data, features) in enumerate(targets, start=1):
+            page = Page.objects.create(name=name, slug=slugify(name), position=position, site=cls.site, page_type=Page.PageType.TARGET, meta_data=meta_data)
+            page.features.set(features)
+            pages.append(page)
+
+        genus = Genus.objects.create(name="Erica")
+        plants = [
+            ([1, 2, 3], [pollinators], [vegetation_type]),
+            ([2, 3, 4, 5], [pollinators, groundcover], [vegetation_type, other_vegetation_type]),
+            ([6], [shade], []),
+            ([], [groundcover], [vegetation_type]),
+            ([7, 8, 12], [pollinators, shade, groundcover], [other_vegetation_type]),
+            ([1, 12], [], [vegetation_type]),
+        ]
+        cls.species = []
+        for count, (flowering, features, vegetation_types) in enumerate(plants, start=1):
+            species = Species.objects.create(name=f"Erica test{count}", genus=genus, flowering=flowering)
+            species.features.set(features)
+            species.vegetation_types.set(vegetation_types)
+            cls.species.append(species)
+
+        # Without a location, gardens get the first vegetation type of their site
+        cls.garden = Garden.objects.create(name="Test garden", site=cls.site)
+        cls.garden.targets.set(pages)
+        for species in cls.species[:4]:
+            GardenSpecies.objects.create(garden=cls.garden, species=species, status="PRESENT")
+        for species in cls.species[4:]:
+            GardenSpecies.objects.create(garden=cls.garden, species=species, status="FUTURE")
+
+    def test_same_scores_as_per_species_implementation(self):
+        for status in ["PRESENT", "FUTURE"]:
+            with self.subTest(status=status):
+                self.assertEqual(get_garden_score(self.garden, status), get_garden_score_per_species(self.garden, status))
+
+    def test_garden_without_species(self):
+        garden = Garden.objects.create(name="Empty garden", site=self.site)
+        self.assertIsNone(get_garden_score(garden, "PRESENT"))
+        self.assertIsNone(get_garden_score_per_species(garden, "PRESENT"))
+
+# The x/y of the tile that contains a point at zoom level z
+def get_tile_coordinates(lng, lat, z):
+    n = 2**z
+    x = int((lng + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return x, y
+
+# Vector tiles are generated by PostGIS, so these run against a synthetic layer of small squares in Cape Town
+class TileTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.document = Document.objects.create(name="Synthetic layer", meta_data={"vector_tiles": True})
+        spaces = []
+        for row in range(10):
+            for col in range(10):
+                lng, lat = 18.42 + col*0.002, -33.92 + row*0.002
+                spaces.append(ReferenceSpace(
+                    name=f"Square {row}-{col}",
+                    source=cls.document,
+                    geometry=geos.Polygon.from_bbox((lng, lat, lng+0.001, lat+0.001)),
+                ))
+        for space in spaces:
+            space.geometry.srid = 4326
+        ReferenceSpace.objects.bulk_create(spaces)
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+    def get_tile(self, z, x, y):
+        return self.client.get(reverse("tiles", args=[self.document.id, z, x, y]))
+
+    def test_tile_with_features(self):
+        z = 14
+        x, y = get_tile_coordinates(18.425, -33.915, z)
+        response = self.get_tile(z, x, y)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/vnd.mapbox-vector-tile")
+        self.assertIn(b"layer", response.content)
+        self.assertIn(b"Square 0-0", response.content)
+
+        # The tile is stored on disk for this version of the layer
+        path = os.path.join(self.media_root, "tiles", str(self.document.id), str(self.document.spaces_version), str(z), str(x), f"{y}.mvt")
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), response.content)
+
+    def test_empty_tile(self):
+        z = 14
+        x, y = get_tile_coordinates(28.0, -26.2, z)
+        response = self.get_tile(z, x, y)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"")
+
+    def test_new_version_is_generated_again(self):
+        z = 14
+        x, y = get_tile_coordinates(18.425, -33.915, z)
+        self.get_tile(z, x, y)
+
+        ReferenceSpace.objects.filter(source=self.document, name="Square 0-0").delete()
+        self.document.bump_spaces_version()
+        response = self.get_tile(z, x, y)
+        self.assertNotIn(b"Square 0-0", response.content)
+        self.assertIn(b"Square 0-1", response.content)
+
+        # Only the tiles of the current version are kept
+        directory = os.path.join(self.media_root, "tiles", str(self.document.id))
+        self.assertEqual(os.listdir(directory), [str(self.document.spaces_version)])
+
+    def test_zoomed_out_tile_is_simplified(self):
+        # At zoom 5 the squares are far smaller than a pixel, so there is much less to send
+        zoomed_out = self.get_tile(5, *get_tile_coordinates(18.425, -33.915, 5)).content
+        zoomed_in = self.get_tile(14, *get_tile_coordinates(18.425, -33.915, 14)).content
+        self.assertLess(len(zoomed_out), len(zoomed_in))
+
+    def test_invalid_tiles(self):
+        self.assertEqual(self.get_tile(3, 8, 0).status_code, 404)
+        self.assertEqual(self.get_tile(23, 0, 0).status_code, 404)
+        document = Document.objects.create(name="Not a shapefile", is_shapefile=False)
+        self.assertEqual(self.client.get(reverse("tiles", args=[document.id, 0, 0, 0])).status_code, 404)
+
+    def test_tiles_url(self):
+        self.assertEqual(self.document.get_tiles_url(), f"/tiles/{self.document.id}/{{z}}/{{x}}/{{y}}.mvt?v={self.document.spaces_version}")
+
+# Saving or deleting spaces bumps the version of their document once per transaction, however many spaces change
+class SpacesVersionTest(TestCase):
+
+    def setUp(self):
+        self.document = Document.objects.create(name="Layer")
+
+    def get_version(self):
+        self.document.refresh_from_db(fields=["spaces_version"])
+        return self.document.spaces_version
+
+    def test_one_bump_per_transaction(self):
+        version = self.get_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            for number in range(3):
+                ReferenceSpace.objects.create(name=f"Space {number}", source=self.document, geometry=geos.Point(18.42, -33.92, srid=4326))
+        self.assertEqual(self.get_version(), version + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.document.spaces.all().delete()
+        self.assertEqual(self.get_version(), version + 2)
+
+    def test_garden_changes_bump_their_layer(self):
+        language = Language.objects.create(name="English", code="en")
+        site = Site.objects.create(name="Test site", url="test.example.org", language=language)
+        version = self.get_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            garden = Garden.objects.create(name="Garden", site=site, source=self.document)
+        self.assertEqual(self.get_version(), version + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            garden.delete()
+        self.assertEqual(self.get_version(), version + 2)
+
+    def test_batch(self):
+        version = self.get_version()
+        with spaces_version_batch():
+            for number in range(3):
+                ReferenceSpace.objects.create(name=f"Space {number}", source=self.document)
+        self.assertEqual(self.get_version(), version + 1)
+
+# The photos of listed gardens are loaded with one prefetch query (see with_primary_photo), so the number of
+# queries of the garden list and the geojson layer must not grow with the number of gardens
+class GardenPhotoQueriesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        language = Language.objects.create(name="English", code="en")
+        cls.site = Site.objects.create(name="Test site", url="testserver", language=language)
+        Page.objects.create(name="Gardens", slug="gardens", position=1, site=cls.site)
+        cls.document = Document.objects.create(name="Garden layer")
+        cls.add_gardens(2)
+
+    # Every garden gets two photos; the one with position 1 is the one that should be shown
+    @classmethod
+    def add_gardens(cls, count):
+        start = Garden.objects.count()
+        for number in range(start, start+count):
+            garden = Garden.objects.create(
+                name=f"Garden {number}",
+                site=cls.site,
+                source=cls.document,
+                geometry=geos.Point(18.42 + number*0.01, -33.92, srid=4326),
+            )
+            for position in [2, 1]:
+                Photo.objects.create(garden=garden, position=position, source="inaturalist", image_inat={"small_url": f"https://example.org/{garden.id}/photo-{position}.jpg"})
+
+    def assert_constant_queries(self, url):
+        # The first request fills the per-process caches (site, nurseries), so we count from the second one
+        self.client.get(url)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+
+        self.add_gardens(5)
+        cache.clear()
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        for garden in Garden.objects.all():
+            self.assertContains(response, f"/{garden.id}/photo-1.jpg")
+            self.assertNotContains(response, f"/{garden.id}/photo-2.jpg")
+
+    def test_garden_list(self):
+        self.assert_constant_queries(reverse("gardens"))
+
+    def test_geojson_layer(self):
+        self.assert_constant_queries(reverse("geojson", args=[self.document.id]))
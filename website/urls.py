@@ -9,6 +9,7 @@ urlpatterns = [
     path("design/", views.design),
     path("gardens/", views.gardens, name="gardens"),
     path("gardens/map/", views.gardens_map, name="gardens_map"),
+    path("gardens/map/gardens.json", views.gardens_json, name="gardens_json"),
     path("gardens/add/", views.garden_form, name="garden_form"),
     path("gardens/<int:id>/", views.garden, name="garden"),
     path("gardens/<int:garden>/photos/", views.photos, name="garden_photos"),
@@ -25,6 +26,7 @@ urlpatterns = [
     path("maps/<int:id>/", views.map, name="map"),
     path("space/<int:id>/", views.space, name="space"),
     path("geojson/<int:id>/", views.geojson, name="geojson"),
+    path("tiles/<int:id>/<int:z>/<int:x>/<int:y>.mvt", views.tiles, name="tiles"),
     path("report/", views.report, name="report"),
     path("report/map/", views.report, {"show_map": True}, name="report_map"),
     path("report/<str:lat>/<str:lng>/", views.report, name="report"),
@@ -154,6 +156,7 @@ urlpatterns = [
     path("controlpanel/shapefiles/<int:id>/classify/", views.controlpanel_shapefile_classify, name="controlpanel_shapefile_classify"),
     path("controlpanel/shapefiles/create/", views.controlpanel_shapefile_form, name="controlpanel_shapefile_form"),
     path("controlpanel/shapefiles/<int:id>/dataviz/", views.controlpanel_shapefile_dataviz, name="controlpanel_shapefile_dataviz"),
+    path("controlpanel/jobs/<int:id>/", views.controlpanel_job, name="controlpanel_job"),
     path("controlpanel/ajax/get_inat_data/<int:id>/", views.controlpanel_ajax_get_inat_data, name="controlpanel_ajax_get_inat_data"),
     path("controlpanel/ajax/get_wikipedia/<int:id>/", views.controlpanel_ajax_get_wikipedia, name="controlpanel_ajax_get_wikipedia"),
 
@@ -1,5 +1,6 @@
 from .forms import *
 from .models import *
+from .scoring import get_garden_score, get_stored_garden_score, load_garden_species, get_flowering_failures, rank_species
 
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
@@ -9,28 +10,39 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.tokens import default_token_generator
 from django.contrib.gis import geos
-from django.contrib.gis.db.models.functions import Area, Transform
+from django.contrib.gis.db.models import Extent
+from django.contrib.gis.db.models.functions import Intersection, Length, Transform
 from django.contrib.gis.measure import D
+from django.contrib.postgres.search import TrigramWordSimilarity
 from django.core import serializers
 from django.core.files import File
 from django.core.files.base import ContentFile
 from django.core.mail import send_mail
+from django.core.cache import cache
 from django.core.paginator import Paginator
-from django.db.models import OuterRef, Subquery, Value, CharField, Q, F, Count, Max, IntegerField, Sum
-from django.db.models.functions import Coalesce
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import OuterRef, Subquery, Value, CharField, Q, F, Count, Max, IntegerField, Sum, FloatField, JSONField, Case, When, Exists
+from django.db.models.functions import Coalesce, Greatest, JSONObject
 from django.forms import modelform_factory
 from django.http import JsonResponse, HttpResponse, Http404, HttpResponseBadRequest
 from django.shortcuts import render, get_object_or_404, redirect
 from django.template.loader import render_to_string, get_template
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
 from django.utils.encoding import force_bytes
-from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode, http_date
 from django.utils.safestring import mark_safe
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 from django.views.decorators.csrf import csrf_exempt
 
+from collections import Counter
+
 import folium
+import functools
+import gzip
+import hashlib
 import io
 import os
 import pandas as pd
@@ -78,15 +90,10 @@ COLOR_SCHEMES = {
 # This needs adjustment for multi-lingual sites but for now it works
 LANGUAGE_ID = 1
 
-# This fetches the site the user is on
+# This fetches the site the user is on (cached, see get_site_for_request in models.py)
 def get_site(request):
     try:
-        if request.COOKIES.get("site"):
-            return Site.objects.get(pk=request.COOKIES.get("site"))
-        else:
-            url = request.META.get("HTTP_HOST")
-            url = url.lower()
-            return Site.objects.get(url=url)
+        return get_site_for_request(request)
     except:
         return None
 
@@ -136,78 +143,25 @@ def get_swapped_corridor_coords(site):
             swapped_corridor_coords = [[y, x] for x, y in corridor] # This is needed for the hole punching to work
     return swapped_corridor_coords
 
-# We calculate the various scores for a garden here
-def get_garden_score(garden, status):
-
-    # For current gardens, only check PRESENT species. For future gardens, we want all plants (present+future)
-    if status == "PRESENT":
-        species = Species.objects.filter(garden_plants__garden=garden, garden_plants__status=status)
-        q_filter = Q(feature__species__garden_plants__garden_id=garden.id, feature__species__garden_plants__status=status)
-    else:
-        species = Species.objects.filter(garden_plants__garden=garden)
-        q_filter = Q(feature__species__garden_plants__garden_id=garden.id)
-
-    veg_type = garden.vegetation_type
-    scores = {}
-    total = 0
-
-    if not species:
+# Returns the zoom level that a map is shown at: either passed in the url (?zoom= or ?bbox=minx,miny,maxx,maxy)
+# or, if spaces are given, the zoom level needed to fit all of them on the map
+def get_requested_zoom(request, spaces=None):
+    try:
+        if "zoom" in request.GET:
+            return int(request.GET["zoom"])
+        elif "bbox" in request.GET:
+            extent = [float(each) for each in request.GET["bbox"].split(",")]
+        elif spaces is not None:
+            extent = spaces.aggregate(extent=Extent("geometry"))["extent"]
+        else:
+            return None
+        width = max(extent[2]-extent[0], extent[3]-extent[1])
+    except (ValueError, TypeError, IndexError):
         return None
-
-    # For species composition we check how many locally indigenous species are present, 
-    # and reduce points for invasives
-    locally_indigenous = species.filter(vegetation_types=veg_type).count()
-    score = min(locally_indigenous, veg_type.minimum_species)*veg_type.score_per_species
-    scores[_("Species composition")] = int(score)
-    total += score
-
-    # For species diversity we check how many of the criteria are met
-    all_criteria = DiversityCriteria.objects.filter(vegetation_type=garden.vegetation_type).count()
-    criteria_met = DiversityCriteria.objects.filter(vegetation_type=garden.vegetation_type).annotate(
-        species_count=Count(
-            "feature__species",
-            filter=q_filter,
-            distinct=True
-        )
-    ).filter(species_count__gte=F("quantity")).count()
-
-    score = int((criteria_met/all_criteria)*100)
-    scores[_("Species diversity")] = score
-    total += score
-
-    for each in garden.targets.all():
-        score = 0
-
-        # Let's see if there are enough plants for this animal species
-        if each.meta_data.get("score_minimum_species"):
-            number_of_species = species.filter(features__in=each.features.all()).count()
-            score = number_of_species/int(each.meta_data.get("score_minimum_species"))*100
-            if score > 100:
-                score = 100
-            if each.meta_data.get("score_minimum_flowering"):
-                score = score/2 # Weight is only 50% if we have a second parameter
-
-        # Let's see if there are enough flowering plants
-        if each.meta_data.get("score_minimum_flowering"):
-
-            score_minimum_flowering = int(each.meta_data.get("score_minimum_flowering"))
-            success_count = 12
-            for month in range(1, 13):
-                flowering_count = species.filter(flowering__contains=[month]).distinct().count()
-                if flowering_count < score_minimum_flowering:
-                    success_count -= 1
-            if each.meta_data.get("score_minimum_flowering"):
-                score += ((success_count/12)*100) / 2 # Weight is 50%
-            else:
-                score += (success_count/12)*100
-
-        scores[each.name] = int(score)
-        total += score
-
-    scores["total"] = int(total)
-
-    return scores
-
+    if width <= 0:
+        return None
+    # A map is roughly 1000px wide, so about four 256px tiles
+    return int(math.log2(360 * 4 / width))
 
 # For a default log entry where we take the user and url from request
 def log_action(request, action, name):
@@ -259,23 +213,18 @@ def map(request, id):
         # If this is only associated to a single space then we show that one
         space = info.spaces.all()[0]
 
+    # Unless the full detail is requested, we use the simplified geometries that fit the zoom level
+    level = None
+    if not "show_full" in request.GET:
+        level = get_simplification_level(get_requested_zoom(request, spaces))
+    spaces = with_simplified_geometry(spaces, level).defer("geometry")
+
     if spaces.count() > 500 and "show_all_spaces" not in request.GET:
         space_count = spaces.count()
         spaces = spaces[:500]
 
-    simplify_factor = None
     geom_type = None
 
-    size = 0
-    # If the file is larger than 20/10/5MB, then we simplify
-    if not "show_full" in request.GET:
-        if size > 1024*1024*20:
-            simplify_factor = 0.05
-        elif size > 1024*1024*10:
-            simplify_factor = 0.02
-        elif size > 1024*1024*5:
-            simplify_factor = 0.001
-
     colors = ["green", "blue", "red", "orange", "brown", "navy", "teal", "purple", "pink", "maroon", "chocolate", "gold", "ivory", "snow"]
     color_features = {}
 
@@ -307,11 +256,8 @@ def map(request, id):
         colors = COLOR_SCHEMES[s]
 
     for each in spaces:
-        geom_type = each.geometry.geom_type
-        if simplify_factor:
-            geo = each.geometry.simplify(simplify_factor)
-        else:
-            geo = each.geometry
+        geo = each.map_geometry
+        geom_type = geo.geom_type
 
         url = each.get_absolute_url()
 
@@ -381,7 +327,7 @@ def space(request, id):
         return response
 
     map = folium.Map(
-        location=[info.geometry.centroid[1], info.geometry.centroid[0]],
+        location=[info.get_lat, info.get_lng],
         zoom_start=14,
         scrollWheelZoom=False,
         attr="Mapbox",
@@ -400,7 +346,7 @@ def space(request, id):
     Fullscreen().add_to(map)
 
     satmap = folium.Map(
-        location=[info.geometry.centroid[1], info.geometry.centroid[0]],
+        location=[info.get_lat, info.get_lng],
         zoom_start=17,
         scrollWheelZoom=False,
         tiles=SATELLITE_TILES,
@@ -433,7 +379,7 @@ def space(request, id):
         "info": info,
         "map": map._repr_html_(),
         "satmap": satmap._repr_html_(),
-        "center": info.geometry.centroid,
+        "center": info.centroid or info.geometry.centroid,
     }
     return render(request, "space.html", context)
 
@@ -482,6 +428,12 @@ def maps(request):
     }
     return render(request, "maps.html", context)
 
+# The total length (in m) of the parts of these spaces that fall within the circle. Clipping, projecting
+# and summing is done by PostGIS so only the total comes back.
+def get_clipped_length(spaces, circle):
+    clipped_length = Sum(Length(Transform(Intersection("geometry", circle), 3857)), output_field=FloatField())
+    return spaces.aggregate(total=clipped_length)["total"] or 0
+
 def report(request, show_map=False, lat=False, lng=False, site_selection=False):
 
     if show_map and not "lat" in request.GET:
@@ -514,7 +466,6 @@ def report(request, show_map=False, lat=False, lng=False, site_selection=False):
     centers = get_object_or_404(Document, pk=983491)
     remnants = get_object_or_404(Document, pk=983097)
     gardens = get_object_or_404(Document, pk=1)
-    vegetation = get_object_or_404(Document, pk=983172)
     boundaries = ReferenceSpace.objects.get(pk=983170)
 
     # These are the layers we open by default on the map
@@ -539,12 +490,8 @@ def report(request, show_map=False, lat=False, lng=False, site_selection=False):
     circle = center.buffer(radius) 
     circle.transform(4326) # Transform back to WGS84 to create geojson
 
-    try:
-        point = geos.Point(x=lng, y=lat)
-        veg = vegetation.spaces.get(geometry__intersects=point)
-        veg = veg.get_vegetation_type()
-    except:
-        veg = None
+    point = geos.Point(x=lng, y=lat, srid=4326)
+    veg = VegetationLocator.for_document(VEGETATION_MAP).locate(point)
 
     #parks = parks.spaces.filter(geometry__within=circle)
     #remnants = remnants.spaces.filter(geometry__distance_lte=(center, D(km=3)))
@@ -558,25 +505,34 @@ def report(request, show_map=False, lat=False, lng=False, site_selection=False):
     railway = railway.spaces.filter(Q(geometry__within=circle)|Q(geometry__intersects=circle))
     centers = centers.spaces.filter(Q(geometry__within=circle)|Q(geometry__intersects=circle))
 
-    # We want to figure out what the total river and railway length (in m) in the circle is.
-    # To do so we need to convert to a coordinate system that measures things in m
-    # See: https://gis.stackexchange.com/questions/180776/get-linestring-length-in-meters-python-geodjango
-    length = 0
-    for each in rivers:
-        geom = each.geometry
-        geom = geom.intersection(circle)
-        geom.transform(3857)
-        length += geom.length
-
-    railway_length = 0
-    for each in railway:
-        geom = each.geometry
-        geom = geom.intersection(circle)
-        geom.transform(3857)
-        railway_length += geom.length
+    # Features are counted live: these are indexed intersects queries, and they count everything that
+    # touches the circle. The river and railway lengths are the slow part, so those come from the
+    # precomputed analysis grid (see build_analysis_grid), which adds up all cells whose center lies
+    # within the circle. The grid only covers the report boundary, so near its edge (or while the grid
+    # is missing or out of date with the layers) we clip the lines live instead.
+    grid = None
+    if info.geometry.contains(circle):
+        grid = AnalysisCell.objects.filter(center__within=circle, layer_versions=get_analysis_layer_versions()).aggregate(
+            cells=Count("id"),
+            river_length=Sum("river_length"),
+            railway_length=Sum("railway_length"),
+        )
+
+    if grid and grid["cells"]:
+        length = grid["river_length"]
+        railway_length = grid["railway_length"]
+    else:
+        # We want to figure out what the total river and railway length (in m) in the circle is.
+        # To do so we need to convert to a coordinate system that measures things in m
+        # See: https://gis.stackexchange.com/questions/180776/get-linestring-length-in-meters-python-geodjango
+        length = get_clipped_length(rivers, circle)
+        railway_length = get_clipped_length(railway, circle)
 
     expansion = {}
+    existing = {}
     expansion["count"] = schools.count() + cemeteries.count() + parks.count() + centers.count()
+    existing["count"] = remnants.count() + gardens.count()
+
     if expansion["count"] <= 1:
         expansion["rating"] = 0
         expansion["label"] = "<span class='badge bg-danger'>poor</span>"
@@ -601,8 +557,6 @@ def report(request, show_map=False, lat=False, lng=False, site_selection=False):
         connectors["label"] = "<span class='badge bg-success'>great</span>"
     connectors["label"] = mark_safe(connectors["label"])
 
-    existing = {}
-    existing["count"] = remnants.count() + gardens.count()
     if existing["count"] <= 0:
         existing["rating"] = 0
         existing["label"] = "<span class='badge bg-danger'>poor</span>"
@@ -676,36 +630,22 @@ def report(request, show_map=False, lat=False, lng=False, site_selection=False):
     }
     return render(request, "website/report.html", context)
 
-def geojson(request, id):
-    info = Document.objects.get(pk=id)
+# Builds the FeatureCollection for a list of spaces from a document. If a circle
+# is given, the geometries are clipped to it. Level is the simplification level to use.
+def get_geojson_data(info, spaces, circle=None, level=None):
     features = []
-    spaces = info.spaces.all()
-    intersection = False
-
-    if "space" in request.GET:
-        spaces = spaces.filter(id=request.GET["space"])
-
-    if "lat" in request.GET and "lng" in request.GET:
-        lat = float(request.GET.get("lat"))
-        lng = float(request.GET.get("lng"))
-        center = geos.Point(x=lng, y=lat, srid=4326)
-        center.transform(3857) # Transform Projection to Web Mercator     
-        radius = 1000 # Number of meters distance
-        circle = center.buffer(radius) 
-        circle.transform(4326) # Transform back to WGS84 to create geojson
-        intersection = True
-        spaces = spaces.filter(Q(geometry__within=circle)|Q(geometry__intersects=circle))
-
     geom_type = None
+    spaces = with_primary_photo(with_simplified_geometry(spaces, level).defer("geometry"))
     for each in spaces:
-        if each.geometry:
-            geom = each.geometry
-            if intersection:
-                geom = each.geometry.intersection(circle)
+        if each.map_geometry:
+            geom = each.map_geometry
+            if circle:
+                geom = geom.intersection(circle)
             url = each.get_absolute_url()
             content = ""
-            if each.photo:
-                content = f"<a class='d-block' href='{url}'><img alt='{each.name}' src='{each.photo.image.thumbnail.url}' /></a><hr>"
+            photo = each.photo
+            if photo:
+                content = f"<a class='d-block' href='{url}'><img alt='{each.name}' src='{photo.thumbnail}' /></a><hr>"
             content = content + f"<a href='{url}'>View details</a>"
             content = content + f"<br><a href='/maps/{info.id}'>View source layer: <strong>{info}</strong></a>"
             if not geom_type:
@@ -720,12 +660,138 @@ def geojson(request, id):
                 },
             })
 
-    data = {
+    return {
         "type":"FeatureCollection",
         "features": features,
         "geom_type": geom_type,
     }
-    return JsonResponse(data)
+
+# The full layer of a document is serialized only once per version of its spaces (see
+# Document.bump_spaces_version) and kept in the cache as gzipped bytes. Photos are not
+# part of the version, so we let the cache expire after a day to pick those up as well.
+GEOJSON_CACHE_TIMEOUT = 60*60*24
+
+def get_cached_geojson(info, level=None):
+    key = f"geojson_{info.id}_{info.spaces_version}_{level}"
+    layer = cache.get(key)
+    if not layer:
+        content = json.dumps(get_geojson_data(info, info.spaces.all(), level=level), cls=DjangoJSONEncoder).encode()
+        last_modified = info.spaces_updated_at or timezone.now()
+        layer = {
+            "content": gzip.compress(content),
+            "etag": f'"{info.id}-{info.spaces_version}-{hashlib.md5(content).hexdigest()[:12]}"',
+            "last_modified": int(last_modified.timestamp()),
+        }
+        cache.set(key, layer, GEOJSON_CACHE_TIMEOUT)
+    return layer
+
+def geojson(request, id):
+    info = Document.objects.get(pk=id)
+    spaces = info.spaces.all()
+    circle = None
+
+    # The map can pass its zoom level (?zoom= or ?bbox=) so we can send simplified geometries
+    level = get_simplification_level(get_requested_zoom(request))
+
+    if "space" not in request.GET and not ("lat" in request.GET and "lng" in request.GET):
+        layer = get_cached_geojson(info, level)
+        response = get_conditional_response(request, etag=layer["etag"], last_modified=layer["last_modified"])
+        if not response:
+            if "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", ""):
+                response = HttpResponse(layer["content"], content_type="application/json")
+                response["Content-Encoding"] = "gzip"
+            else:
+                response = HttpResponse(gzip.decompress(layer["content"]), content_type="application/json")
+        response["ETag"] = layer["etag"]
+        response["Last-Modified"] = http_date(layer["last_modified"])
+        patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+    if "space" in request.GET:
+        spaces = spaces.filter(id=request.GET["space"])
+
+    if "lat" in request.GET and "lng" in request.GET:
+        lat = float(request.GET.get("lat"))
+        lng = float(request.GET.get("lng"))
+        center = geos.Point(x=lng, y=lat, srid=4326)
+        center.transform(3857) # Transform Projection to Web Mercator     
+        radius = 1000 # Number of meters distance
+        circle = center.buffer(radius) 
+        circle.transform(4326) # Transform back to WGS84 to create geojson
+        spaces = spaces.filter(Q(geometry__within=circle)|Q(geometry__intersects=circle))
+
+    return JsonResponse(get_geojson_data(info, spaces, circle, level))
+
+# Vector tiles (MVT) for large layers, generated by PostGIS and cached on disk per version of the document.
+# Geometries are simplified to roughly one screen pixel at the requested zoom level.
+TILE_EXTENT = 4096
+TILE_MAX_ZOOM = 22
+WEB_MERCATOR_WIDTH = 2 * 20037508.342789244
+
+def get_tiles_directory(info, version=None):
+    path = os.path.join(settings.MEDIA_ROOT, "tiles", str(info.id))
+    return os.path.join(path, str(version)) if version is not None else path
+
+# Tiles of earlier versions are never requested again (the tile url includes the version), so when
+# the first tile of a new version is written, the directories of the older versions are removed
+def remove_old_tiles(info):
+    directory = get_tiles_directory(info)
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.isdigit() and int(name) < info.spaces_version:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+def get_tile(info, z, x, y):
+    path = os.path.join(get_tiles_directory(info, info.spaces_version), str(z), str(x), f"{y}.mvt")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    tolerance = WEB_MERCATOR_WIDTH / 2**z / 256
+    query = f"""
+        WITH bounds AS (
+            SELECT ST_TileEnvelope(%s, %s, %s) AS geom
+        ),
+        features AS (
+            SELECT
+                ST_AsMVTGeom(ST_SimplifyPreserveTopology(ST_Transform(space.geometry, 3857), %s), bounds.geom, {TILE_EXTENT}, 64, true) AS geom,
+                space.id,
+                space.name,
+                CASE WHEN garden.referencespace_ptr_id IS NULL THEN '/space/' || space.id || '/' ELSE '/gardens/' || space.id || '/' END AS url
+            FROM {ReferenceSpace._meta.db_table} space
+            LEFT JOIN {Garden._meta.db_table} garden ON garden.referencespace_ptr_id = space.id
+            CROSS JOIN bounds
+            WHERE space.source_id = %s AND space.geometry && ST_Transform(bounds.geom, 4326)
+        )
+        SELECT ST_AsMVT(features.*, 'layer', {TILE_EXTENT}, 'geom') FROM features WHERE features.geom IS NOT NULL
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(query, [z, x, y, tolerance, info.id])
+        tile = cursor.fetchone()[0]
+    tile = bytes(tile) if tile else b""
+
+    # Write to a temporary file first so that other requests never read half a tile
+    if not os.path.isdir(get_tiles_directory(info, info.spaces_version)):
+        remove_old_tiles(info)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex}"
+    with open(temp_path, "wb") as f:
+        f.write(tile)
+    os.replace(temp_path, path)
+
+    return tile
+
+def tiles(request, id, z, x, y):
+    info = get_object_or_404(Document, pk=id, is_shapefile=True)
+    if z > TILE_MAX_ZOOM or x >= 2**z or y >= 2**z:
+        raise Http404("Tile not found")
+
+    response = HttpResponse(get_tile(info, z, x, y), content_type="application/vnd.mapbox-vector-tile")
+
+    # The templates add the version of the document to the tile url, so these can be cached for a while
+    patch_cache_control(response, public=True, max_age=60*60*24)
+    return response
 
 def species_overview(request, vegetation_type=None):
 
@@ -827,6 +893,19 @@ def species_search(request, vegetation_type=None):
     }
     return render(request, "species/search.html", context)
 
+# Returns the ids of the present and the future species of a garden as two sets, so that
+# the species lists can check each row with {% if each.id in in_garden_present %}
+def get_garden_species_ids(garden):
+    present = set()
+    future = set()
+    if garden:
+        for species_id, status in GardenSpecies.objects.filter(garden=garden).values_list("species_id", "status"):
+            if status == "PRESENT":
+                present.add(species_id)
+            elif status == "FUTURE":
+                future.add(species_id)
+    return present, future
+
 def species_list(request, genus=None, family=None, vegetation_type=None, garden=None, garden_status=None):
 
     site = get_site(request)
@@ -835,7 +914,12 @@ def species_list(request, genus=None, family=None, vegetation_type=None, garden=
     title = _("Search results")
     nurseries = None
 
-    species = Species.objects.filter(site=site)
+    # Every species gets its index row when it is saved (or from the bulk import), but should one be missing
+    # we still list it through the plain site link rather than leave it out
+    species = Species.objects.filter(
+        Q(search_index__site_ids__contains=[site.id]) |
+        Q(search_index__isnull=True, pk__in=Species.site.through.objects.filter(site=site).values("species_id"))
+    )
     total_species = species.count()
 
     species = species \
@@ -859,15 +943,17 @@ def species_list(request, genus=None, family=None, vegetation_type=None, garden=
         species = species.filter(family=family)
         full_list = Family.objects.all()
 
+    # All the filters on related objects go through the species search index (see SpeciesSearchIndex),
+    # so that we don't need a join for each of them
     if "vegetation_type" in request.GET:
         vegetation_type = VegetationType.objects.get(pk=request.GET["vegetation_type"])
-        species = species.filter(vegetation_types=vegetation_type)
+        species = species.filter(search_index__vegetation_type_ids__contains=[vegetation_type.id])
     elif vegetation_type:
         vegetation_type = VegetationType.objects.get(slug=vegetation_type)
-        species = species.filter(vegetation_types=vegetation_type)
+        species = species.filter(search_index__vegetation_type_ids__contains=[vegetation_type.id])
     elif "spatial_classification" in request.GET:
         vegetation_type = SpeciesFeatures.objects.get(pk=request.GET["spatial_classification"])
-        species = species.filter(features=vegetation_type)
+        species = species.filter(search_index__feature_ids__contains=[vegetation_type.id])
 
     if garden is not None:
         # This is for when we open the list of species for a particular garden
@@ -883,39 +969,38 @@ def species_list(request, genus=None, family=None, vegetation_type=None, garden=
         # that they are managing; in which case we want to show the right buttons to save species
         garden = get_garden(request, request.COOKIES.get("garden_id"))
 
-    in_garden_future = None
-    in_garden_present = None
-    if garden:
-        in_garden_future = Species.objects.filter(garden_plants__garden=garden, garden_plants__status="FUTURE")
-        in_garden_present = Species.objects.filter(garden_plants__garden=garden, garden_plants__status="PRESENT")
+    in_garden_present, in_garden_future = get_garden_species_ids(garden)
 
     features = None
     if "feature" in request.GET:
         features = SpeciesFeatures.objects.filter(pk__in=request.GET.getlist("feature"))
+        feature_ids = list(features.values_list("id", flat=True))
         if request.GET.get("search") == "all":
-            for each in features:
-                species = species.filter(features=each)
+            species = species.filter(search_index__feature_ids__contains=feature_ids)
         else:
-            species = species.filter(features__in=features)
+            species = species.filter(search_index__feature_ids__overlap=feature_ids)
 
     source = None
     if "source" in request.GET:
         source = Document.objects.get(pk=request.GET["source"])
-        species = species.filter(log__file__attached_to=source, site=site)
+        species = species.filter(search_index__source_ids__contains=[source.id])
 
     if "nursery" in request.GET:
         nurseries = Page.objects.filter(page_type=Page.PageType.NURSERY, pk__in=request.GET.getlist("nursery"), is_active=True, site=site)
-        species = species.filter(inventory__nursery__in=nurseries)
+        nursery_ids = list(nurseries.values_list("id", flat=True))
         if "in_stock" in request.GET:
-            species = species.filter(inventory__in_stock=True)
+            species = species.filter(search_index__in_stock_nursery_ids__overlap=nursery_ids)
+        else:
+            species = species.filter(search_index__nursery_ids__overlap=nursery_ids)
         title = _("Nursery inventory:") + " " + ", ".join(nurseries.values_list("name", flat=True))
         
     colors = None
     if "color" in request.GET:
         colors = Color.objects.filter(pk__in=request.GET.getlist("color"))
-        species = species.filter(colors__in=colors)
+        species = species.filter(search_index__color_ids__overlap=list(colors.values_list("id", flat=True)))
 
-    species = species.distinct()
+    # The only join left is the one to the garden plants, which has one row per species
+    species = with_common_name(species, request.language)
 
     info = None
     photo = None
@@ -1015,14 +1100,12 @@ def rehabilitation_plant_selection(request):
     return render(request, "website/assessment.html", context)
 
 # Get species text in the local language, with English as a fall-back
+# Returns the text in the active language, or the English text if there is none, in one query
 def fetch_species_text(request, species):
-    info = SpeciesText.objects.filter(language__code=request.language, species=species)
-    if not info:
-        info = SpeciesText.objects.filter(language_id=1, species=species)
-    if info:
-        return info[0]
-    else:
-        return SpeciesText()
+    info = SpeciesText.objects.filter(
+        Q(language__code=request.language) | Q(language_id=ENGLISH), species=species
+    ).order_by(Case(When(language__code=request.language, then=0), default=1), "id").first()
+    return info if info else SpeciesText()
 
 @csrf_exempt
 def species(request, id):
@@ -1046,12 +1129,13 @@ def species(request, id):
             GardenSpecies.objects.filter(garden=garden, species=info).delete()
             response["action"] = "removed"
         elif "btn-white" in classes or "btn-light" in classes:
-            if in_garden:
-                in_garden.status = request.POST["action"]
-                in_garden.save()
+            added, existing = GardenSpecies.bulk_add(garden, [info.id], request.POST["action"])
+            if existing:
+                # Moving a species from one list to the other
+                GardenSpecies.objects.filter(garden=garden, species=info).update(status=request.POST["action"])
+                mark_garden_scores_stale(garden=garden)
                 response["action"] = "changed"
             else:
-                GardenSpecies.objects.create(garden=garden, species=info, status=request.POST["action"])
                 response["action"] = "created"
         return JsonResponse(response)
 
@@ -1114,7 +1198,7 @@ def species_sources(request):
 def species_source(request, id):
     site = get_site(request)
     info = Document.objects.get(site=site, doc_type="SPECIES_LIST", pk=id)
-    species = Species.objects.filter(log__file__attached_to=info, site=site).prefetch_related("features").all()
+    species = with_common_name(Species.objects.filter(log__file__attached_to=info, site=site).prefetch_related("features"), request.language)
 
     view = request.GET.get("view")
     if view == "photos":
@@ -1137,7 +1221,14 @@ def species_source(request, id):
 
 def gardens(request):
     site = get_site(request)
-    gardens = Garden.objects.prefetch_related("organizations").filter(is_active=True, site=site)
+    gardens = with_primary_photo(with_suburb(Garden.objects.prefetch_related("organizations").filter(is_active=True, site=site)))
+
+    # When showing the garden areas (instead of points) we use simplified geometries if the map is zoomed out,
+    # and for the points we only need the stored centroid
+    if "area" in request.GET:
+        gardens = with_simplified_geometry(gardens, get_simplification_level(get_requested_zoom(request, gardens)))
+    gardens = gardens.defer("geometry")
+
     context = {
         "gardens": gardens,
         "page_info": get_object_or_404(Page, slug="gardens", site=site),
@@ -1152,7 +1243,8 @@ def gardens(request):
 
 def gardens_map(request):
     site = get_site(request)
-    gardens = Garden.objects.prefetch_related("organizations").filter(is_active=True, site=site)
+    # The map itself is loaded from gardens_json, the table doesn't need any geometries
+    gardens = with_suburb(Garden.objects.prefetch_related("organizations").filter(is_active=True, site=site)).defer("geometry")
     context = {
         "gardens": gardens,
         "info": Page.objects.get(pk=2),
@@ -1165,6 +1257,43 @@ def gardens_map(request):
     }
     return render(request, "gardens/map.html", context)
 
+# Compact marker data for the gardens map, loaded by the map page after the page itself. Everything
+# comes from a single query: the outline is the medium simplified geometry and the first photo is
+# fetched as a JSON object so that we can build its thumbnail url without loading the photo.
+def get_gardens_data(site):
+    photo = Photo.objects.filter(garden=OuterRef("pk")).order_by("position", "date").values(
+        data=JSONObject(image="image", source="source", image_inat="image_inat")
+    )[:1]
+    gardens = with_simplified_geometry(Garden.objects.filter(site=site), SimplifiedGeometry.Level.MEDIUM).annotate(
+        first_photo=Subquery(photo, output_field=JSONField()),
+    ).order_by("id").values_list("id", "name", "garden_number", "centroid", "map_geometry", "first_photo")
+
+    data = []
+    for id, name, garden_number, centroid, outline, first_photo in gardens:
+        thumbnail = None
+        if first_photo and (first_photo["image"] or first_photo["image_inat"]):
+            thumbnail = Photo(**first_photo).thumbnail
+        data.append({
+            "id": id,
+            "name": name,
+            "number": f"{garden_number:03d}" if garden_number else None,
+            "url": reverse("garden", args=[id]),
+            "lat": centroid.y if centroid else None,
+            "lng": centroid.x if centroid else None,
+            "outline": json.loads(outline.geojson) if outline and outline.geom_type != "Point" else None,
+            "thumbnail": thumbnail,
+        })
+    return data
+
+def gardens_json(request):
+    site = get_site(request)
+    key = get_gardens_cache_key(site.id)
+    data = cache.get(key)
+    if data is None:
+        data = get_gardens_data(site)
+        cache.set(key, data, GEOJSON_CACHE_TIMEOUT)
+    return JsonResponse({"gardens": data})
+
 def garden(request, id):
     info = Garden.objects_unfiltered.get(pk=id)
     site = get_site(request)
@@ -1194,12 +1323,12 @@ def garden(request, id):
         "body_padding": True,
         "swapped_corridor_coords": get_swapped_corridor_coords(site),
         "load_map": True,
-        "plants": Species.objects.filter(garden_plants__garden=info, garden_plants__status="PRESENT"),
+        "plants": with_common_name(Species.objects.filter(garden_plants__garden=info, garden_plants__status="PRESENT"), request.language),
         "tab": "garden",
 
         # Because we have tabs above the <main>, we need to unround the top-left corner if the first tab is active
         "main_classes": "rounded-tl-none" if garden else None,
-        "score_present": get_garden_score(info, "PRESENT"),
+        "score_present": get_stored_garden_score(info, "PRESENT"),
     }
     return render(request, "gardens/garden.html", context)
 
@@ -1226,8 +1355,8 @@ def garden_score_overview(request, id):
         "tab": "score",
         "title": _("Score"),
         "info": info,
-        "score_present": get_garden_score(info, "PRESENT"),
-        "score_future": get_garden_score(info, "FUTURE") if GardenSpecies.objects.filter(garden=info, status="FUTURE").exists() else None,
+        "score_present": get_stored_garden_score(info, "PRESENT"),
+        "score_future": get_stored_garden_score(info, "FUTURE") if GardenSpecies.objects.filter(garden=info, status="FUTURE").exists() else None,
     }
     return render(request, "gardens/score.overview.html", context)
 
@@ -1400,7 +1529,6 @@ def vegetation_types(request):
         return redirect(vegetation_type.get_absolute_url())
 
     features = []
-    simplify_factor = None
 
     colors = ["green", "blue", "red", "orange", "brown", "navy", "teal", "purple", "pink", "maroon", "chocolate", "gold", "ivory", "snow"]
     color_features = {}
@@ -1409,10 +1537,18 @@ def vegetation_types(request):
     legend = {}
     properties = None
     show_individual_colors = True
+    geom_type = None
+
+    # For large layers the map loads vector tiles instead, so we don't need to build the features here
+    if info.use_vector_tiles:
+        spaces = []
+    else:
+        level = get_simplification_level(get_requested_zoom(request, spaces))
+        spaces = with_simplified_geometry(spaces, level).defer("geometry")
 
     for each in spaces:
-        geom_type = each.geometry.geom_type
-        geo = each.geometry
+        geo = each.map_geometry
+        geom_type = geo.geom_type
         url = each.get_absolute_url()
 
         # If we need separate colors we'll itinerate over them one by one
@@ -1463,7 +1599,7 @@ def vegetation_types(request):
         "colors": colors,
         "features": features,
         "mapstyle": properties.mapstyle if properties else None,
-
+        "vector_tiles": info.get_tiles_url() if info.use_vector_tiles else None,
     }
     return render(request, "fcc/vegetationtypes.html", context)
 
@@ -1505,7 +1641,6 @@ def vegetation_type(request, slug):
 
 def profile(request, section=None, lat=None, lng=None, id=None, subsection=None):
 
-    vegetation = get_object_or_404(Document, pk=983172)
     veg = None
     link = None
 
@@ -1522,13 +1657,12 @@ def profile(request, section=None, lat=None, lng=None, id=None, subsection=None)
     try:
         lat = float(lat)
         lng = float(lng)
-        center = geos.Point(lng, lat)
-        veg = vegetation.spaces.get(geometry__intersects=center)
-        veg = VegetationType.objects.get(spaces=veg)
-        suburb = ReferenceSpace.objects.filter(source_id=334434, geometry__intersects=center)
+        center = geos.Point(lng, lat, srid=4326)
+        veg = VegetationLocator.for_document(VEGETATION_MAP).locate(center)
+        if not veg:
+            raise VegetationType.DoesNotExist
+        suburb = get_suburb(center)
         species = Species.objects.filter(vegetation_types=veg)
-        if suburb:
-            suburb = suburb[0].name.title()
     except:
         messages.warning(request, f"We are unable to locate the relevant vegetation type. Please make sure to <a href='/fynbos-rehabilitation/site-selection/'>select a site on the map</a> first, so that we can load the relevant plant species for your chosen location.")
         suburb = None
@@ -2255,10 +2389,8 @@ def carbon_report(request, id, planner=False):
 
     info = Page.objects.get(slug="carbon-report", is_active=True, site=site)
 
-    # SRID 6933 (WGS 84 / Cylindrical Equal-Area). 
-    # This projection is structurally designed to keep area measurements perfectly accurate globally. 
-    # Transform to this and get the area.
-    garden = Garden.objects_unfiltered.annotate(size=Area(Transform("geometry", 6933))).filter(pk=id).first()
+    # The area is stored when the garden is saved, measured in an equal-area projection (see AREA_SRID)
+    garden = Garden.objects_unfiltered.filter(pk=id).first()
 
     if request.method == "POST":
         if not garden.meta_data:
@@ -2282,8 +2414,8 @@ def carbon_report(request, id, planner=False):
         carbon_sequestered += trees * TREE_CO2 # kg per tree
 
     # We prioritize calculated size
-    if garden.size:
-        garden_size = garden.size.sq_m
+    if garden.area:
+        garden_size = garden.area
     else:
         garden_size = int(garden.meta_data.get("size", 0)) if garden.meta_data else 0
 
@@ -2388,8 +2520,8 @@ def planner(request, id=None):
         "garden": garden,
         "species_present": GardenSpecies.objects.filter(garden=garden, status="PRESENT").count(),
         "species_future": GardenSpecies.objects.filter(garden=garden, status="FUTURE").count(),
-        "score_present": get_garden_score(garden, "PRESENT") if garden else None,
-        "score_future": get_garden_score(garden, "FUTURE") if garden else None,
+        "score_present": get_stored_garden_score(garden, "PRESENT") if garden else None,
+        "score_future": get_stored_garden_score(garden, "FUTURE") if garden else None,
         "planner_tab": "my_garden",
         "my_gardens": Garden.objects_unfiltered.filter(user=request.user) if request.user.is_authenticated else None,
         "hide_bottom_planner_menu": True if not garden else False,
@@ -2463,16 +2595,6 @@ def planner_location(request, id):
         lng = float(request.GET.get("lng"))
         garden.geometry = geos.Point(lng, lat)
 
-        try:
-            vegetation = site.vegetation_types_map
-            point = geos.Point(x=lng, y=lat)
-            veg = vegetation.spaces.get(geometry__intersects=point)
-            veg = veg.get_vegetation_type()
-            garden.vegetation_type = veg
-            garden.save()
-        except:
-            veg = None
-
         garden.save()
 
         if "new_garden" in request.GET:
@@ -2577,7 +2699,7 @@ def planner_suggestions(request, id):
     if not (garden := get_garden(request, id)):
         return redirect("planner")
 
-    species = Species.objects.filter(site=site) \
+    species = with_common_name(Species.objects.filter(site=site), request.language) \
         .prefetch_related("features").all()
 
     view = request.GET.get("view")
@@ -2594,12 +2716,13 @@ def planner_suggestions(request, id):
         feature = SpeciesFeatures.objects.filter(pk__in=request.GET.getlist("feature"))
         for each in feature:
             filter_text.append(each)
-        species = species.filter(features__in=feature)
+        species = species.filter(search_index__feature_ids__overlap=[each.id for each in feature])
 
     if "page_id" in request.GET:
         page = Page.objects.get(pk=request.GET["page_id"], site=site)
-        species = species.filter(features__in=page.features.all())
-        for each in page.features.all():
+        page_features = list(page.features.all())
+        species = species.filter(search_index__feature_ids__overlap=[each.id for each in page_features])
+        for each in page_features:
             filter_text.append(each)
 
     if "month" in request.GET:
@@ -2626,52 +2749,44 @@ def planner_suggestions(request, id):
     # We combine the ones above with the site-wide feature if any
     features = features | site.features.all()
 
-    score_subquery = (
-        FeatureSiteScore.objects.filter(
-            site=site,
-            feature__in=features,
-            feature__species=OuterRef("pk"),
-        )
-        .values("feature__species")
-        .annotate(total=Sum("points"))
-        .values("total")
-    )
-
-    # Annotate the species list with the subquery result
-    species = species.annotate(
-        total_points=Coalesce(Subquery(score_subquery), Value(0))
-    ).order_by("-total_points")
-
-    # We use this to create bars showing relative score
-    max_points = species.aggregate(Max("total_points"))["total_points__max"]
-    #if vegetation_type and species.exists():
-    #    max_points += 1 # Add one because it will also meet the vegetation type parameter
+    # The species are ranked in memory with the feature matrix of the site (see rank_species), so
+    # here we only need the ids of the species that match the filters
+    candidate_ids = list(species.order_by("name").values_list("id", flat=True))
+    species_count = len(candidate_ids)
 
     # Get the top 50 species only
     more_species_available = False
-    species_count = species.count()
+    limit = None
     if species_count > 50 and not "view_all" in request.GET:
-        species_count = 50
-        species = species[:species_count]
+        species_count = limit = 50
         more_species_available = True
 
+    # We use the max points to create bars showing relative score
+    ranked_ids, ranked_points, max_points = rank_species(site, features.values_list("id", flat=True), candidate_ids, limit)
+
     if "add_all" in request.GET:
-        for each in species.all():
-            try:
-                GardenSpecies.objects.create(garden=garden, species=each, status="FUTURE")
-            except:
-                # If the species is already in the list there will be an error but it seems
-                # too much to report this to the user.
-                pass
-        messages.success(request, _("The species have been added to your planting list."))
+        added, existing = GardenSpecies.bulk_add(garden, ranked_ids, "FUTURE")
+        msg = _("%(added)s species have been added to your planting list.") % { "added": added }
+        if existing:
+            msg += " " + _("%(existing)s species were already on your lists.") % { "existing": existing }
+        messages.success(request, msg)
         return redirect(request.path)
 
+    species = species.in_bulk(ranked_ids)
+    species_list = []
+    for species_id, points in zip(ranked_ids, ranked_points):
+        each = species[species_id]
+        each.total_points = points
+        species_list.append(each)
+
+    in_garden_present, in_garden_future = get_garden_species_ids(garden)
+
     context = {
         "menu": "planner",
         "page": "suggestions",
         "title": _("Suggested plant list"),
         "garden": garden,
-        "species_list": species,
+        "species_list": species_list,
         "species_count": species_count,
         "load_datatables": True,
         "vegetation_type": vegetation_type,
@@ -2681,8 +2796,8 @@ def planner_suggestions(request, id):
         "table_hide_form": True,
         "table_show_score": True,
         "more_species_available": more_species_available,
-        "in_garden_present": Species.objects.filter(garden_plants__garden=garden, garden_plants__status="PRESENT"),
-        "in_garden_future": Species.objects.filter(garden_plants__garden=garden, garden_plants__status="FUTURE"),
+        "in_garden_present": in_garden_present,
+        "in_garden_future": in_garden_future,
         "hide_species_tabs": True,
         "filter_text": filter_text,
 
@@ -2711,7 +2826,7 @@ def planner_plants(request, id, status):
 
     if "undo_delete" in request.GET:
         plant = Species.objects.get(pk=request.GET["undo_delete"])
-        GardenSpecies.objects.create(garden=garden, species=plant, status=status)
+        GardenSpecies.bulk_add(garden, [plant.id], status)
         messages.success(request, _("%(plant)s has been added.") % { "plant": str(plant) })
         return redirect(request.path)
 
@@ -2817,7 +2932,7 @@ def planner_plants_download(request, id):
     if not (garden := get_garden(request, id)):
         return redirect("planner")
 
-    plants = Species.objects.filter(garden_plants__garden=garden, garden_plants__status="FUTURE")
+    plants = with_common_name(Species.objects.filter(garden_plants__garden=garden, garden_plants__status="FUTURE"), request.language)
 
     if request.method == "POST":
         wb = Workbook()
@@ -2872,8 +2987,8 @@ def planner_score_overview(request, id):
         "tab": "overview",
         "title": _("Score"),
         "garden": garden,
-        "score_present": get_garden_score(garden, "PRESENT"),
-        "score_future": get_garden_score(garden, "FUTURE") if GardenSpecies.objects.filter(garden=garden, status="FUTURE").exists() else None,
+        "score_present": get_stored_garden_score(garden, "PRESENT"),
+        "score_future": get_stored_garden_score(garden, "FUTURE") if GardenSpecies.objects.filter(garden=garden, status="FUTURE").exists() else None,
 
         # Because we have tabs above the <main>, we need to unround the top-left corner if the first tab is active
         "main_classes": "rounded-tl-none",
@@ -2889,41 +3004,31 @@ def planner_score(request, id, status):
 
     if status == "PRESENT":
         species = Species.objects.filter(garden_plants__garden=garden, garden_plants__status=status)
-        q_filter = Q(feature__species__garden_plants__garden_id=garden.id, feature__species__garden_plants__status=status)
     else:
         species = Species.objects.filter(garden_plants__garden=garden)
-        q_filter = Q(feature__species__garden_plants__garden_id=garden.id)
+
+    veg_type = garden.vegetation_type if garden.vegetation_type else site.vegetation_types.all().first()
+
+    # All counts (flowering per month, species per feature, locally indigenous) come from this single load
+    data = load_garden_species(garden, status, veg_type)
+
     feature_species = {}
     flowering_failure = {}
     flowering_success = {}
 
     # Here we get all the species that are a hit for a particular feature
     for page in garden.targets.all():
-        features = page.features.all()
         feature_species[page.id] = species.filter(features__in=page.features.all())
         score_minimum_flowering = int(page.meta_data.get("score_minimum_flowering", 0))
 
         if score_minimum_flowering:
-
-            fails_check = []
-            success_count = 12
-            for month in range(1, 13):
-                flowering_count = species.filter(flowering__contains=[month]).distinct().count()
-                if flowering_count < score_minimum_flowering:
-                    fails_check.append(MONTH_CHOICES[month - 1])  # month - 1 to match the index
-                    success_count -= 1
-
+            fails_check = [MONTH_CHOICES[month - 1] for month in get_flowering_failures(data, score_minimum_flowering)] # month - 1 to match the index
             flowering_failure[page.id] = fails_check
-            flowering_success[page.id] = success_count
+            flowering_success[page.id] = 12 - len(fails_check)
 
-    veg_type = garden.vegetation_type if garden.vegetation_type else site.vegetation_types.all().first()
-    criteria = DiversityCriteria.objects.filter(vegetation_type=veg_type).annotate(
-        species_count=Count(
-            "feature__species",
-            filter=q_filter,
-            distinct=True
-        )
-    )
+    criteria = list(DiversityCriteria.objects.filter(vegetation_type=veg_type).select_related("feature"))
+    for each in criteria:
+        each.species_count = data["feature_counts"][each.feature_id]
 
     if status == "PRESENT":
         bad_veg = VegetationType.objects.filter(site=site, is_negative=True, negative_points__isnull=False).annotate(
@@ -2946,11 +3051,11 @@ def planner_score(request, id, status):
         "flowering_failure": flowering_failure,
         "flowering_success": flowering_success,
         "title": _("Future garden score card") if status == "FUTURE" else _("Current garden score card"),
-        "scores": get_garden_score(garden, status),
+        "scores": get_garden_score(garden, status, data) if veg_type else None,
         "diversity": criteria,
         "veg_type": veg_type,
         "bad_veg_types": bad_veg,
-        "locally_indigenous": species.filter(vegetation_types=veg_type).count(),
+        "locally_indigenous": data["locally_indigenous"],
     }
     return render(request, "planner/score.html", context)
 
@@ -3407,7 +3512,8 @@ def controlpanel_page(request, id=None):
             return redirect(request.path + "?species")
         elif request.method == "POST":
             if request.POST.get("delete_all"):
-                NurseryInventory.objects.filter(nursery=info).delete()
+                with species_search_index_batch():
+                    NurseryInventory.objects.filter(nursery=info).delete()
                 messages.success(request, _("All items were removed."))
                 return redirect(request.path + "?species")
             if request.POST.get("species_list"):
@@ -3446,44 +3552,46 @@ def controlpanel_page(request, id=None):
                 available_col = cols_lower_map["available"]
                 all_species = []
 
-                for idx, row in df.iterrows():
-                    name = row.get(name_col).strip()
-                    try:
-                        price = float(row.get(price_col))
-                        price = None if math.isnan(price) else price
-                        unit = row.get(unit_col).strip()
-                    except Exception:
-                        price = None
-                        unit = None
-                    species = None
-                    try:
-                        available = row.get(available_col).strip().lower()
-                        if available == "yes":
-                            available = True
-                        elif available == "no":
-                            available = False
-                        else:
+                # The search index is refreshed once for all species in the file, not per row
+                with species_search_index_batch():
+                    for idx, row in df.iterrows():
+                        name = row.get(name_col).strip()
+                        try:
+                            price = float(row.get(price_col))
+                            price = None if math.isnan(price) else price
+                            unit = row.get(unit_col).strip()
+                        except Exception:
+                            price = None
+                            unit = None
+                        species = None
+                        try:
+                            available = row.get(available_col).strip().lower()
+                            if available == "yes":
+                                available = True
+                            elif available == "no":
+                                available = False
+                            else:
+                                available = None
+                        except:
                             available = None
-                    except:
-                        available = None
-                    try:
-                        species = Species.objects.get(name=name)
-                    except:
-                        error = _("The following species was not found in our database: %(name)s") % {"name": name}
-                        if error not in errors:
-                            errors.append(error)
-                    if unit:
                         try:
-                            unit = InventoryUnit.objects.get(unit__iexact=unit, site=site)
+                            species = Species.objects.get(name=name)
                         except:
-                            errors.append(_("The following unit was not found in our database: %(unit)s (species: %(name)s)") % {"unit": unit, "name": name})
-                            unit = None
-                    if species and unit and price:
-                        NurseryInventory.objects.create(nursery=info, species=species, unit=unit, price=price, in_stock=available)
-                        all_species.append(species)
-                    elif species and species not in all_species:
-                        NurseryInventory.objects.create(nursery=info, species=species, in_stock=available)
-                        all_species.append(species)
+                            error = _("The following species was not found in our database: %(name)s") % {"name": name}
+                            if error not in errors:
+                                errors.append(error)
+                        if unit:
+                            try:
+                                unit = InventoryUnit.objects.get(unit__iexact=unit, site=site)
+                            except:
+                                errors.append(_("The following unit was not found in our database: %(unit)s (species: %(name)s)") % {"unit": unit, "name": name})
+                                unit = None
+                        if species and unit and price:
+                            NurseryInventory.objects.create(nursery=info, species=species, unit=unit, price=price, in_stock=available)
+                            all_species.append(species)
+                        elif species and species not in all_species:
+                            NurseryInventory.objects.create(nursery=info, species=species, in_stock=available)
+                            all_species.append(species)
                 info.meta_data["inventory_last_update"] = timezone.now().date().isoformat()
                 info.save()
                 if errors:
@@ -3840,6 +3948,163 @@ def controlpanel_document(request, id=None, tab=None):
     }
     return render(request, "controlpanel/document.html", context)
 
+# Spreadsheets are parsed once and shared between the preview and the import (which are separate
+# requests). The modification time is part of the key so that a replaced file is parsed again.
+SPECIES_SHEET_CACHE_TIMEOUT = 60*60
+
+def read_species_sheet(file_info):
+    try:
+        modified = file_info.file.storage.get_modified_time(file_info.file.name).timestamp()
+    except (NotImplementedError, OSError):
+        modified = None
+
+    cache_key = f"species_sheet_{file_info.id}_{modified}"
+    df = cache.get(cache_key)
+    if df is None:
+        # We assume 2 sheets; one Meta Data followed by Plants; we read the 2nd
+        # We assume a top-row which is not actually the header; let's drop it (header=1)
+        df = pd.read_excel(file_info.file, sheet_name=1, header=1)
+
+        # Strip all the column names
+        df.columns = df.columns.str.strip()
+        cache.set(cache_key, df, SPECIES_SHEET_CACHE_TIMEOUT)
+    return df
+
+# Cleans up the Name column of a species sheet and replaces synonyms by the species they refer to.
+# Only the synonyms of the names in the sheet are fetched. Returns the names plus two boolean series:
+# which rows were synonyms and which rows are valid (genus + species).
+def normalize_species_names(df):
+    names = df["Name"].astype("string").str.strip()
+    lowercase = names.str.lower()
+    synonyms = dict(SpeciesSynonym.objects.filter(name__in=set(lowercase.dropna())).values_list("name", "species__name"))
+
+    is_synonym = lowercase.isin(list(synonyms)).fillna(False).astype(bool)
+    names = names.where(~is_synonym, lowercase.map(synonyms))
+    valid = (names.str.split().str.len() >= 2).fillna(False).astype(bool)
+    return names, is_synonym, valid
+
+# Imports a species list (a dataframe with a Name column and optional Link, Colour (flower),
+# Time (flowering) and feature columns) in a fixed number of queries, no matter how many rows there
+# are: the columns are parsed with pandas, genera and species are looked up and created in bulk and
+# all links are written with bulk_create(ignore_conflicts=True), all in a single transaction.
+# Returns the outcome of every row: created, existing, synonym or skipped, plus any warnings.
+def import_species_list(df, file_info, site, user, vegetation_type=None, features=None):
+    names, is_synonym, valid = normalize_species_names(df)
+
+    outcomes = [{"row": int(index) + 3, "name": name if isinstance(name, str) else "", "outcome": "skipped", "warnings": []} for index, name in zip(df.index, names.tolist())]
+    valid_names = names[valid]
+
+    def split_column(column):
+        # One row per comma-separated value, lowercased, indexed by the row it came from
+        values = df.loc[valid, column]
+        values = values[values.map(lambda value: isinstance(value, str))].str.split(",").explode().str.strip().str.lower()
+        return values[values.notna() & (values != "")]
+
+    MONTH_NAME_TO_ID = {month: number for number, month in enumerate(["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], start=1)}
+    position = {index: i for i, index in enumerate(df.index)}
+
+    with transaction.atomic():
+        # A file can be imported again, in which case it replaces what it imported before
+        previous_ids = set(FileLog.objects.filter(file=file_info).values_list("species_id", flat=True))
+        SpeciesVegetationTypeLink.objects.filter(file=file_info).delete()
+        FileLog.objects.filter(file=file_info).delete()
+
+        genus_names = set(valid_names.str.split().str[0])
+        genera = dict(Genus.objects.filter(name__in=genus_names).values_list("name", "id"))
+        Genus.objects.bulk_create([Genus(name=name) for name in genus_names - genera.keys()])
+        genera = dict(Genus.objects.filter(name__in=genus_names).order_by("-id").values_list("name", "id"))
+
+        existing = set(Species.objects.filter(name__in=set(valid_names)).values_list("name", flat=True))
+        Species.objects.bulk_create([
+            Species(name=name, genus_id=genera[name.split()[0]]) for name in set(valid_names) - existing
+        ], ignore_conflicts=True)
+        species = {each.name: each for each in Species.objects.filter(name__in=set(valid_names)).only("id", "name", "links", "flowering")}
+        species_ids = valid_names.map(lambda name: species[name].id)
+
+        for index, name in valid_names.items():
+            outcome = outcomes[position[index]]
+            if is_synonym[index]:
+                outcome["outcome"] = "synonym"
+            else:
+                outcome["outcome"] = "existing" if name in existing else "created"
+
+        # Links and flowering months are stored on the species itself. Later rows for the same species
+        # are applied after earlier ones, like they would be if we imported row by row.
+        changed = set()
+        if "Link" in df.columns:
+            for index, link in df.loc[valid, "Link"].items():
+                if isinstance(link, str) and link.strip():
+                    each = species[valid_names[index]]
+                    if link.strip() not in (each.links or []):
+                        each.links = (each.links or []) + [link.strip()]
+                        changed.add(each)
+
+        has_flowering = set()
+        if "Time (flowering)" in df.columns:
+            months = split_column("Time (flowering)")
+            unknown = months[~months.isin(MONTH_NAME_TO_ID.keys())]
+            for index, month in unknown.items():
+                outcomes[position[index]]["warnings"].append(_("The month was not found:") + " " + month)
+            months = months[months.isin(MONTH_NAME_TO_ID.keys())].map(MONTH_NAME_TO_ID)
+            for index, row_months in months.groupby(level=0):
+                each = species[valid_names[index]]
+                each.flowering = row_months.tolist()
+                changed.add(each)
+                has_flowering.add(index)
+
+        Species.objects.bulk_update(changed, ["links", "flowering"], batch_size=1000)
+
+        species_colors = []
+        has_colors = set()
+        if "Colour (flower)" in df.columns:
+            colors = {color.name: color.id for color in Color.objects.all()}
+            values = split_column("Colour (flower)")
+            for index, color in values.items():
+                if color in colors:
+                    species_colors.append(Species.colors.through(species_id=species_ids[index], color_id=colors[color]))
+                    has_colors.add(index)
+                else:
+                    outcomes[position[index]]["warnings"].append(_("The color was not found:") + " " + color)
+        Species.colors.through.objects.bulk_create(species_colors, ignore_conflicts=True)
+
+        if vegetation_type:
+            # We store this link in a table so we can trace it back, mark the actual species as
+            # belonging to this vegetation type and make sure they are activated for the current site
+            SpeciesVegetationTypeLink.objects.bulk_create([
+                SpeciesVegetationTypeLink(species_id=id, vegetation_type=vegetation_type, file=file_info) for id in species_ids
+            ], batch_size=1000)
+            Species.vegetation_types.through.objects.bulk_create([
+                Species.vegetation_types.through(species_id=id, vegetationtype_id=vegetation_type.id) for id in set(species_ids)
+            ], ignore_conflicts=True)
+            Species.site.through.objects.bulk_create([
+                Species.site.through(species_id=id, site_id=site.id) for id in set(species_ids)
+            ], ignore_conflicts=True)
+
+        # We store all the features and log this, one log per row
+        logs = FileLog.objects.bulk_create([
+            FileLog(file=file_info, species_id=species_ids[index], user=user, colors=index in has_colors, flowering=index in has_flowering)
+            for index in valid_names.index
+        ], batch_size=1000)
+        logs = dict(zip(valid_names.index, logs))
+
+        species_features = []
+        log_features = []
+        for column, feature in (features or {}).items():
+            marks = df.loc[valid, column].astype("string").str.strip().str.lower().isin(["x", "yes"]).fillna(False)
+            for index in marks[marks].index:
+                species_features.append(Species.features.through(species_id=species_ids[index], speciesfeatures_id=feature.id))
+                log_features.append(FileLog.features.through(filelog_id=logs[index].id, speciesfeatures_id=feature.id))
+        Species.features.through.objects.bulk_create(species_features, batch_size=1000, ignore_conflicts=True)
+        FileLog.features.through.objects.bulk_create(log_features, batch_size=1000, ignore_conflicts=True)
+
+    # None of the above sends signals, so we do here what the signal handlers would have done
+    ids = set(species_ids)
+    refresh_species_search_index(ids | previous_ids)
+    mark_garden_scores_stale(garden__plants__species_id__in=ids)
+    bump_suggestion_matrix_version()
+
+    return outcomes
+
 @staff_member_required
 def controlpanel_document_species(request, id):
     info = Document.objects.get(pk=id)
@@ -3853,15 +4118,9 @@ def controlpanel_document_species(request, id):
     features = {}
     other_characteristics = OTHER_CHARACTERISTICS
     error = None
-    synonyms = dict(SpeciesSynonym.objects.values_list("name", "species__name"))
 
     try:
-        # We assume 2 sheets; one Meta Data followed by Plants; we read the 2nd
-        # We assume a top-row which is not actually the header; let's drop it (header=1)
-        df = pd.read_excel(file, sheet_name=1, header=1)
-
-        # Strip all the column names
-        df.columns = df.columns.str.strip()
+        df = read_species_sheet(file_info)
         header_names = df.columns.tolist()
 
     except Exception as e:
@@ -3869,22 +4128,6 @@ def controlpanel_document_species(request, id):
         messages.error(request, error)
 
     if header_names:
-
-        MONTH_NAME_TO_ID = {
-            "jan": 1,
-            "feb": 2,
-            "mar": 3,
-            "apr": 4,
-            "may": 5,
-            "jun": 6,
-            "jul": 7,
-            "aug": 8,
-            "sep": 9,
-            "oct": 10,
-            "nov": 11,
-            "dec": 12,
-        }
-
         for each in header_names:
             if each in other_characteristics:
                 existing_features.append(each)
@@ -3898,105 +4141,24 @@ def controlpanel_document_species(request, id):
         vegetation_type = None
         if request.POST.get("vegetation_type"):
             vegetation_type = VegetationType.objects.get(pk=request.POST["vegetation_type"])
-        SpeciesVegetationTypeLink.objects.filter(file=file_info).delete()
-        FileLog.objects.filter(file=file_info).delete()
-
-        # Same for plant colors
-        if "Colour (flower)" in existing_features:
-            colors = {}
-            for each in Color.objects.all():
-                colors[each.name] = each
-
         try:
-            for index,row in df.iterrows():
-
-                name = row["Name"].strip()
-                if name.lower() in synonyms:
-                    name = synonyms[name.lower()]
-
-                # Only process if there are at least 2 words
-                if len(name.split()) >= 2:
-
-                    genus = Genus.objects.filter(name=name.split()[0])
-                    if genus:
-                        genus = genus[0]
-                    else:
-                        genus = Genus.objects.create(name=name.split()[0])
+            outcomes = import_species_list(df, file_info, site, request.user, vegetation_type, features)
+
+            # The outcome of every row is kept with the document so that it can be reviewed afterwards
+            counts = Counter(each["outcome"] for each in outcomes)
+            if not info.meta_data:
+                info.meta_data = {}
+            info.meta_data["species_import"] = {
+                "file": file_info.id,
+                "date": str(timezone.now()),
+                "counts": dict(counts),
+                "rows": outcomes,
+            }
+            info.save()
 
-                    species = Species.objects.filter(name=name)
-                    if species:
-                        species = species[0]
-                    else:
-                        species = Species.objects.create(
-                            name = name,
-                            genus = genus,
-                        )
-
-                    # We store this link in a table so we can trace it back...
-                    if vegetation_type:
-                        SpeciesVegetationTypeLink.objects.create(
-                            species = species,
-                            vegetation_type = vegetation_type,
-                            file = file_info,
-                        )
-
-                        # And we mark the actual species as belonging to this vegetation type
-                        species.vegetation_types.add(vegetation_type)
-
-                        # And make sure this is activated for the current site
-                        species.site.add(site)
-
-                    must_save = False
-                    has_colors = False
-                    has_flowering = False
-
-                    if "Link" in existing_features:
-                        link = row["Link"].strip()
-                        links = species.links or []
-                        if link not in links:
-                            links.append(link)
-                            species.links = links
-                            must_save = True
-
-                    if "Colour (flower)" in existing_features and isinstance(row["Colour (flower)"], str):
-                        color_list = row["Colour (flower)"]
-                        for each in color_list.split(","):
-                            color = each.strip().lower()
-                            if color in colors:
-                                species.colors.add(colors[color])
-                                has_colors = True
-                            else:
-                                messages.warning(request, _("The color was not found:") + " " + color + " - " + species.name)
-
-                    if "Time (flowering)" in existing_features and isinstance(row["Time (flowering)"], str):
-                        months = []
-                        month_list = row["Time (flowering)"]
-                        for each in month_list.split(","):
-                            month = each.strip().lower()
-                            if month:
-                                if month in MONTH_NAME_TO_ID:
-                                    months.append(MONTH_NAME_TO_ID[month])
-                                    has_flowering = True
-                                else:
-                                    messages.warning(request, _("The month was not found:") + " - <strong>" + month + "</strong> - " + species.name)
-
-                        if months:
-                            species.flowering = months
-                            must_save = True
-
-                    if must_save:
-                        species.save()
-
-                    # We store all the features and log this
-                    log = FileLog.objects.create(file=file_info, species=species, user=request.user, colors=has_colors, flowering=has_flowering)
-                    for each in existing_features:
-                        if each not in other_characteristics:
-                            feature = row[each];
-                            if isinstance(feature, str):
-                                feature = feature.strip().lower()
-                            if feature == "x" or feature == "yes":
-                                species.features.add(features[each])
-                                log.features.add(features[each])
+            warnings = [f"{each['row']}: {each['name']} - {warning}" for each in outcomes for warning in each["warnings"]]
+            if warnings:
+                messages.warning(request, "<br>".join(warnings[:50]))
 
             return redirect(reverse("controlpanel_species_list") + "?import=true&file=" + request.GET["file"])
 
@@ -4004,14 +4166,9 @@ def controlpanel_document_species(request, id):
             error = _("There was a problem with this file. Are you sure it is formatted correctly? See below the error: ") + str(e)
             messages.error(request, error)
 
-    results = []
-    alerts = []
     new_species = []
     species_count = 0
     if not error:
-        if len(df) > 200:
-            df = df[:200]
-            messages.warning(request, _("Your spreadsheet has more rows, but we only show 200 below. When you import them, ALL records will be imported"))
         try:
             required_columns = ["Name"]
             missing_columns = [col for col in required_columns if col not in df.columns]
@@ -4027,40 +4184,30 @@ def controlpanel_document_species(request, id):
                 messages.error(request, error)
 
             if not error:
-                for index, row in df.iterrows():
-                    # Handle NaN or empty values cleanly
-                    name = row["Name"]
-                    if pd.isna(name) or str(name).strip() == "":
-                        alerts.append(_("Row skipped: Name field is empty."))
-                        results.append("✖️")
-                        continue
-
-                    name = str(name).strip()
-                    name_words = name.split()
-                    exists = False
-                    synonym = False
-                    
-                    if len(name_words) < 2:
-                        alerts.append(_("Species names must contain genus + species. This row is invalid and will NOT be added."))
-                    else:
-                        alerts.append("")
-                        if name.lower() in synonyms:
-                            name = synonyms[name.lower()]
-                            synonym = True
-                            exists = True
-                        else:
-                            exists = Species.objects.filter(name=name).exists()
-                    
-                    if synonym:
-                        results.append("✓ SYN")
-                    else:
-                        results.append("✓" if exists else "✖️")
-                    species_count += 1
-                    if not exists:
-                        new_species.append(name)
-
-                df.insert(1, "Exists", results)
-                df.insert(2, "Details", alerts)
+                # All rows are checked at once: one query for the synonyms and one for the existing species
+                original_names = df["Name"].astype("string").str.strip()
+                empty = (original_names.isna() | (original_names == "")).astype(bool)
+                names, is_synonym, valid = normalize_species_names(df)
+                existing = Species.objects.filter(name__in=set(names[valid & ~is_synonym])).values_list("name", flat=True)
+                exists = valid & (is_synonym | names.isin(list(existing)))
+
+                results = pd.Series("✖️", index=df.index)
+                results[exists] = "✓"
+                results[valid & is_synonym] = "✓ SYN"
+
+                alerts = pd.Series("", index=df.index)
+                alerts[~valid] = str(_("Species names must contain genus + species. This row is invalid and will NOT be added."))
+                alerts[empty] = str(_("Row skipped: Name field is empty."))
+
+                species_count = int((~empty).sum())
+                new_species = names[valid & ~exists].tolist()
+
+                if len(df) > 200:
+                    df = df[:200]
+                    messages.warning(request, _("Your spreadsheet has more rows, but we only show 200 below. When you import them, ALL records will be imported"))
+
+                df.insert(1, "Exists", results[df.index])
+                df.insert(2, "Details", alerts[df.index])
                 df = df.fillna("")
                 html_table = df.to_html(classes="table", escape=False)
 
@@ -4232,34 +4379,17 @@ def controlpanel_shapefile(request, id):
     info = Document.objects.filter(Q(site=site) | Q(site__isnull=True)).get(pk=id, is_shapefile=True)
 
     if "create_shapefile_plot" in request.POST:
-        plot = info.create_shapefile_plot()
-        if plot:
-            messages.success(request, "Plot image was created.")
-        else:
-            messages.error(request, "There was a problem creating the plot.")
+        Job.objects.create(job_type=Job.JobType.SHAPEFILE_PLOT, document=info, user=request.user)
+        messages.success(request, "The plot will be created in the background.")
         return redirect(request.get_full_path())
     elif "clip" in request.POST:
         clip_boundaries = ReferenceSpace.objects.get(pk=request.POST["clip"])
-        info.meta_data["clip"] = request.POST["clip"]
-        info.save()
-
-        # First we delete the spaces that are outside the clipped area
-        spaces = info.spaces.exclude(Q(geometry__within=clip_boundaries.geometry)|Q(geometry__intersects=clip_boundaries.geometry))
-        total_to_delete = int(spaces.count())
-        spaces.delete()
-
-        # And then we cut off those that cross boundaries
-        intersecting = info.spaces.filter(geometry__intersects=clip_boundaries.geometry)
-        for each in intersecting:
-            sliced_geometry = each.geometry.intersection(clip_boundaries.geometry)
-            each.geometry = sliced_geometry
-            each.save()
-
-        messages.success(request, f"Borders were clipped to {clip_boundaries.name}; {total_to_delete} spaces were removed and {intersecting.count()} spaces were clipped.")
+        Job.objects.create(job_type=Job.JobType.CLIP_SPACES, document=info, params={"clip": clip_boundaries.id}, user=request.user)
+        messages.success(request, f"The borders will be clipped to {clip_boundaries.name} in the background.")
         return redirect(request.get_full_path())
     elif "convert_shapefile" in request.POST:
-        if info.shpinfo["count"] > 1000:
-            # There is a way to limit processing items with 1000 records. However, for now if people
+        if info.shpinfo["count"] > SHAPEFILE_SIZE_CHECK:
+            # There is a way to limit processing items with SHAPEFILE_SIZE_CHECK records. However, for now if people
             # see the alert and accept it, we automatically override this limit. Later we can restrict
             # who can automatically do that and who can't
             info.meta_data["skip_size_check"] = True
@@ -4288,13 +4418,28 @@ def controlpanel_shapefile(request, id):
         "menu": "documents",
         "type": "shapefiles",
         "info": info,
+        "jobs": info.jobs.order_by("-created_at")[:5],
         "size_in_bytes": size_in_bytes,
         "corridors": ReferenceSpace.objects.filter(source__doc_type="CORRIDOR"),
         "clip_boundaries": clip_boundaries,
         "load_form": True,
+        "size_check": SHAPEFILE_SIZE_CHECK,
     }
     return render(request, "controlpanel/shapefile.html", context)
 
+# Used by the control panel to poll the status of a background job
+@staff_member_required
+def controlpanel_job(request, id):
+    job = get_object_or_404(Job, pk=id)
+    return JsonResponse({
+        "id": job.id,
+        "status": job.status,
+        "status_display": job.get_status_display(),
+        "is_active": job.is_active,
+        "progress": job.progress,
+        "message": job.message,
+    })
+
 @staff_member_required
 def controlpanel_shapefile_form(request, id=None):
     site = get_site(request)
@@ -4458,9 +4603,8 @@ def controlpanel_shapefile_classify(request, id):
 
         info.save()
 
-        info.spaces.all().delete()
-        info.convert_shapefile()
-        messages.success(request, "Shapefile data was imported into the system")
+        Job.objects.create(job_type=Job.JobType.CONVERT_SHAPEFILE, document=info, user=request.user)
+        messages.success(request, "The shapefile data will be imported into the system in the background")
         return redirect(reverse("controlpanel_shapefile", args=[info.id]))
 
     context = {
@@ -4597,6 +4741,10 @@ def controlpanel_species_list(request):
 
     if "import" in request.GET:
         context["inat_missing"] = species.filter(~Q(meta_data__has_key="inat")).count()
+        report = source.meta_data.get("species_import") if source and source.meta_data else None
+        if report and str(report["file"]) == request.GET.get("file"):
+            context["import_report"] = report
+            context["import_problems"] = [each for each in report["rows"] if each["outcome"] == "skipped" or each["warnings"]]
 
     if "descriptions" in request.GET:
 
@@ -4926,6 +5074,11 @@ def controlpanel_features(request):
         ]
         FeatureSiteScore.objects.bulk_create(new_features)
 
+        # bulk_create() doesn't send post_save, so we do what the FeatureSiteScore receivers would do
+        if new_features:
+            bump_suggestion_matrix_version()
+            mark_garden_scores_stale(garden__site=site)
+
         messages.success(request, _("Feature configuration has been saved."))
         return redirect(request.path)
 
@@ -5159,36 +5312,46 @@ def controlpanel_user(request, id=None):
     return render(request, "controlpanel/user.html", context)
 
 # AJAX
-def ajax_species(request):
-    query = request.GET.get("q")
-    site = get_site(request)
-
-    common_name_subquery = SpeciesText.objects.filter(
-        species=OuterRef("pk"),
-        language_id=LANGUAGE_ID
-    ).values("common_name")[:1]
-
-    species = Species.objects.prefetch_related("site").filter(
-        Q(name__icontains=query) | 
-        Q(texts__common_name__icontains=query, texts__language_id=LANGUAGE_ID)
-    ).annotate(common_name=Subquery(common_name_subquery)).distinct()
+AUTOCOMPLETE_LIMIT = 30
+
+# The results of the species autocomplete, ranked by how well the scientific or (English) common name
+# matches. Matching uses the trigram indexes on the names (see Species.Meta), synonyms included.
+def search_species(query, site_id, active_only=False):
+    common_names = SpeciesText.objects.filter(common_name__icontains=query, language_id=LANGUAGE_ID).values("species_id")
+    synonyms = SpeciesSynonym.objects.filter(name__icontains=query).values("species_id")
+    common_name = SpeciesText.objects.filter(species=OuterRef("pk"), language_id=LANGUAGE_ID).values("common_name")[:1]
+
+    species = Species.objects.filter(
+        Q(name__icontains=query) | Q(pk__in=common_names) | Q(pk__in=synonyms)
+    ).annotate(
+        common_name=Subquery(common_name),
+        active=Exists(Species.site.through.objects.filter(species_id=OuterRef("pk"), site_id=site_id)),
+    ).annotate(
+        rank=Greatest(
+            TrigramWordSimilarity(query, "name"),
+            Coalesce(TrigramWordSimilarity(query, "common_name"), Value(0.0)),
+        ),
+    )
+    if active_only:
+        species = species.filter(active=True)
 
-    if "active_only" in request.GET:
-        species = species.filter(site=site)
+    return [
+        {"id": id, "name": name, "common_name": common_name, "active": active}
+        for id, name, common_name, active in species.order_by("-rank", "name").values_list("id", "name", "common_name", "active")[:AUTOCOMPLETE_LIMIT]
+    ]
 
-    results = []
-    for each in species:
+# Every keystroke hits the autocomplete, mostly with the same short prefixes, so we keep the most
+# recent results per process. The time bucket makes sure that nothing is cached for more than 5 minutes.
+@functools.lru_cache(maxsize=2048)
+def search_species_cached(query, site_id, active_only, bucket):
+    return search_species(query, site_id, active_only)
 
-        if "active_only" in request.GET:
-            is_active = True
-        else:
-            is_active = site in each.site.all()
+def ajax_species(request):
+    query = request.GET.get("q", "").strip().lower()
+    site = get_site(request)
 
-        results.append({
-            "id": each.id,
-            "name": each.name,
-            "common_name": each.common_name,
-            "active": is_active,
-        })
+    if not query:
+        return JsonResponse([], safe=False)
 
+    results = search_species_cached(query, site.id, "active_only" in request.GET, int(time.time() // 300))
     return JsonResponse(results, safe=False)